@@ -0,0 +1,36 @@
+import threading
+
+
+DEFAULT_CAPTURE_BUDGET = 1_000_000
+
+
+class CaptureBudget:
+    """Process-wide memory budget for request and response bodies buffered by all in-flight requests."""
+
+    def __init__(self, limit: int = DEFAULT_CAPTURE_BUDGET) -> None:
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> int:
+        return max(0, self.limit - self.used)
+
+    def acquire(self, size: int) -> bool:
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size: int) -> None:
+        with self._lock:
+            self.used = max(0, self.used - size)
+
+
+body_capture_budget = CaptureBudget()
+
+
+def configure_capture_budget(limit: int) -> None:
+    """Set the maximum number of body bytes buffered at once by all middleware instances in this process."""
+    body_capture_budget.limit = limit
@@ -1,6 +1,15 @@
 from dataclasses import dataclass, field
 from typing import Any, TypedDict
 
+from apitally_serverless.common.consumers import CONSUMER_CREDENTIAL_HEADERS, ConsumerResolver
+from apitally_serverless.common.latency import DEFAULT_MIN_SAMPLES
+from apitally_serverless.common.output import DEFAULT_MAX_SPLIT_RECORD_LENGTH
+from apitally_serverless.common.scheduling import FinalizeScheduler
+
+
+MAX_BODY_SIZE = 10_000
+STREAMING_CONTENT_TYPES = ["text/event-stream"]
+
 
 class ApitallyConfigKwargs(TypedDict, total=False):
     enabled: bool
@@ -11,6 +20,45 @@ class ApitallyConfigKwargs(TypedDict, total=False):
     mask_headers: list[str]
     mask_body_fields: list[str]
     exclude_paths: list[str]
+    schema_masking: bool
+    masked_body_cache_size: int
+    max_body_size: int
+    route_policies: list["ApitallyRoutePolicy"]
+    split_large_records: bool
+    max_split_record_length: int
+    string_table_size: int
+    string_table_reset_interval: int
+    finalize_scheduler: FinalizeScheduler | None
+    finalize_executor_threshold: int | None
+    finalize_executor_workers: int
+    finalize_executor_queue_size: int
+    overhead_budget: float | None
+    max_in_flight: int | None
+    governor_sample_rate: float
+    streaming_content_types: list[str]
+    emit_provisional_records: bool
+    profile_slow_threshold: float | None
+    capture_logs: bool
+    latency_tracking: bool
+    latency_min_samples: int
+    consumer_resolver: ConsumerResolver | None
+    consumer_credential_headers: list[str]
+    consumer_cache_size: int
+    consumer_cache_ttl: float
+
+
+@dataclass
+class ApitallyRoutePolicy:
+    path: str
+    method: str | None = None
+    log_request_headers: bool | None = None
+    log_request_body: bool | None = None
+    log_response_headers: bool | None = None
+    log_response_body: bool | None = None
+    max_body_size: int | None = None
+    profile_slow_threshold: float | None = None
+    mask_headers: list[str] = field(default_factory=list)
+    mask_body_fields: list[str] = field(default_factory=list)
 
 
 @dataclass
@@ -23,6 +71,31 @@ class ApitallyConfig:
     mask_headers: list[str] = field(default_factory=list)
     mask_body_fields: list[str] = field(default_factory=list)
     exclude_paths: list[str] = field(default_factory=list)
+    schema_masking: bool = False
+    masked_body_cache_size: int = 0
+    max_body_size: int = MAX_BODY_SIZE
+    route_policies: list[ApitallyRoutePolicy] = field(default_factory=list)
+    split_large_records: bool = False
+    max_split_record_length: int = DEFAULT_MAX_SPLIT_RECORD_LENGTH
+    string_table_size: int = 0
+    string_table_reset_interval: int = 1000
+    finalize_scheduler: FinalizeScheduler | None = None
+    finalize_executor_threshold: int | None = None
+    finalize_executor_workers: int = 2
+    finalize_executor_queue_size: int = 32
+    overhead_budget: float | None = None
+    max_in_flight: int | None = None
+    governor_sample_rate: float = 0.1
+    streaming_content_types: list[str] = field(default_factory=lambda: list(STREAMING_CONTENT_TYPES))
+    emit_provisional_records: bool = False
+    profile_slow_threshold: float | None = None
+    capture_logs: bool = False
+    latency_tracking: bool = False
+    latency_min_samples: int = DEFAULT_MIN_SAMPLES
+    consumer_resolver: ConsumerResolver | None = None
+    consumer_credential_headers: list[str] = field(default_factory=lambda: list(CONSUMER_CREDENTIAL_HEADERS))
+    consumer_cache_size: int = 1024
+    consumer_cache_ttl: float = 300.0
 
     @classmethod
     def from_kwargs(cls, kwargs: ApitallyConfigKwargs) -> "ApitallyConfig":
@@ -1,8 +1,16 @@
+import asyncio
+import hashlib
+import inspect
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
+from typing import Awaitable, Callable, Mapping
 
 
 _seen_consumer_hashes: set[int] = set()
 
+CONSUMER_CREDENTIAL_HEADERS = ["authorization", "x-api-key"]
+
 
 @dataclass
 class ApitallyConsumer:
@@ -22,3 +30,89 @@ class ApitallyConsumer:
                 self.group = None
             else:
                 _seen_consumer_hashes.add(h)
+
+
+ConsumerResolver = Callable[
+    [Mapping[str, str]],
+    ApitallyConsumer | None | Awaitable[ApitallyConsumer | None],
+]
+
+
+class ConsumerResolverCache:
+    """
+    Resolves consumers from request headers using a user-provided resolver, caching results (including misses) by
+    a hash of the request's credentials in a bounded TTL/LRU cache. Concurrent misses for the same credentials are
+    coalesced into a single resolver call.
+    """
+
+    def __init__(
+        self,
+        resolver: ConsumerResolver,
+        credential_headers: list[str] | None = None,
+        max_size: int = 1024,
+        ttl: float = 300.0,
+        negative_ttl: float = 60.0,
+    ) -> None:
+        self.resolver = resolver
+        self.credential_headers = credential_headers or CONSUMER_CREDENTIAL_HEADERS
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, tuple[float, ApitallyConsumer | None]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future[ApitallyConsumer | None]] = {}
+
+    def get_cache_key(self, headers: Mapping[str, str]) -> str | None:
+        values = [headers.get(h) or "" for h in self.credential_headers]
+        if not any(values):
+            return None
+        return hashlib.sha256("\0".join(values).encode()).hexdigest()
+
+    async def resolve(self, headers: Mapping[str, str]) -> ApitallyConsumer | None:
+        key = self.get_cache_key(headers)
+        if key is None:
+            return None
+
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return _copy_consumer(entry[1])
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return _copy_consumer(await asyncio.shield(pending))
+
+        self.misses += 1
+        future: asyncio.Future[ApitallyConsumer | None] = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        consumer: ApitallyConsumer | None = None
+        try:
+            result = self.resolver(headers)
+            if inspect.isawaitable(result):
+                result = await result
+            consumer = result if isinstance(result, ApitallyConsumer) else None
+            self._store(key, consumer)
+        except Exception:
+            # Resolver errors are not cached, so the next request retries
+            consumer = None
+        finally:
+            del self._pending[key]
+            future.set_result(consumer)
+        return consumer
+
+    def _store(self, key: str, consumer: ApitallyConsumer | None) -> None:
+        ttl = self.ttl if consumer is not None else self.negative_ttl
+        self._cache[key] = (time.monotonic() + ttl, consumer)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+
+def _copy_consumer(consumer: ApitallyConsumer | None) -> ApitallyConsumer | None:
+    # Creating a new instance applies the deduplication of names and groups already sent
+    if consumer is None:
+        return None
+    return ApitallyConsumer(consumer.identifier, name=consumer.name, group=consumer.group)
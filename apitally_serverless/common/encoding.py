@@ -0,0 +1,44 @@
+import zlib
+
+
+# wbits values for zlib: 16 + MAX_WBITS expects a gzip header, MAX_WBITS a zlib header
+ZLIB_WBITS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "x-gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+
+class BodyDecoder:
+    """Incrementally decompresses a content-encoded body, refusing to produce more than `max_size` bytes."""
+
+    def __init__(self, wbits: int, max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.too_large = False
+        self._decompressor = zlib.decompressobj(wbits=wbits)
+
+    def decode(self, chunk: bytes) -> bytes | None:
+        """Return the decoded chunk, or None if the body is too large or can't be decoded."""
+        if self.too_large:
+            return None
+        remaining = self.max_size - self.size
+        try:
+            decoded = self._decompressor.decompress(chunk, remaining + 1)
+        except zlib.error:
+            return None
+        if len(decoded) > remaining or self._decompressor.unconsumed_tail:
+            self.too_large = True
+            return None
+        self.size += len(decoded)
+        return decoded
+
+
+def is_identity_encoding(content_encoding: str | None) -> bool:
+    return not content_encoding or content_encoding.strip().lower() == "identity"
+
+
+def create_body_decoder(content_encoding: str, max_size: int) -> BodyDecoder | None:
+    """Create a decoder for the given content encoding, or return None if it isn't supported."""
+    wbits = ZLIB_WBITS.get(content_encoding.strip().lower())
+    return BodyDecoder(wbits, max_size) if wbits is not None else None
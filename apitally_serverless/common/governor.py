@@ -0,0 +1,75 @@
+import random
+import threading
+from enum import IntEnum
+
+
+class CaptureLevel(IntEnum):
+    FULL = 0
+    HEADERS = 1
+    METADATA = 2
+    SAMPLED = 3
+
+
+class OverheadGovernor:
+    """
+    Steps down the capture level when the middleware's own overhead or the number of in-flight requests exceeds the
+    configured budget, and steps back up with hysteresis once load drops.
+    """
+
+    def __init__(
+        self,
+        overhead_budget: float | None = None,
+        max_in_flight: int | None = None,
+        sample_rate: float = 0.1,
+        window: int = 100,
+        min_dwell: int = 50,
+        recovery_ratio: float = 0.5,
+    ) -> None:
+        self.overhead_budget = overhead_budget
+        self.max_in_flight = max_in_flight
+        self.sample_rate = sample_rate
+        self.min_dwell = min_dwell
+        self.recovery_ratio = recovery_ratio
+        self.level = CaptureLevel.FULL
+        self.in_flight = 0
+        self.overhead_ratio = 0.0
+        self._alpha = 2 / (window + 1)
+        self._since_change = 0
+        self._lock = threading.Lock()
+
+    def enter(self) -> CaptureLevel:
+        self.in_flight += 1
+        return self.level
+
+    def exit(self) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def should_sample(self) -> bool:
+        return random.random() < self.sample_rate
+
+    def record(self, overhead: float, duration: float) -> None:
+        """Record the CPU time spent by the middleware on a request and the wall-clock duration of the request."""
+        ratio = overhead / duration if duration > 0 else 0.0
+        # Records may be finalized on executor threads
+        with self._lock:
+            self.overhead_ratio += self._alpha * (ratio - self.overhead_ratio)
+            self._since_change += 1
+            if self._since_change < self.min_dwell:
+                return
+
+            if self._is_overloaded() and self.level < CaptureLevel.SAMPLED:
+                self.level = CaptureLevel(self.level + 1)
+                self._since_change = 0
+            elif self._has_recovered() and self.level > CaptureLevel.FULL:
+                self.level = CaptureLevel(self.level - 1)
+                self._since_change = 0
+
+    def _is_overloaded(self) -> bool:
+        if self.overhead_budget is not None and self.overhead_ratio > self.overhead_budget:
+            return True
+        return self.max_in_flight is not None and self.in_flight > self.max_in_flight
+
+    def _has_recovered(self) -> bool:
+        if self.overhead_budget is not None and self.overhead_ratio > self.overhead_budget * self.recovery_ratio:
+            return False
+        return self.max_in_flight is None or self.in_flight <= self.max_in_flight * self.recovery_ratio
@@ -0,0 +1,135 @@
+import threading
+from typing import TypedDict
+
+
+MAX_TRACKED_ROUTES = 1000
+DEFAULT_MIN_SAMPLES = 100
+
+
+class RouteLatencyDict(TypedDict):
+    count: int
+    p50: float
+    p95: float
+    p99: float
+
+
+class P2Quantile:
+    """
+    Streaming estimate of a single quantile using the P² algorithm (Jain & Chlamtac, 1985).
+
+    Keeps five markers regardless of the number of observations, so both memory and update cost are constant.
+    """
+
+    def __init__(self, p: float) -> None:
+        self.p = p
+        self.count = 0
+        self._heights: list[float] = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]
+        self._increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    @property
+    def value(self) -> float:
+        if self.count == 0:
+            return 0.0
+        if self.count < 5:
+            heights = sorted(self._heights)
+            return heights[min(len(heights) - 1, int(self.p * len(heights)))]
+        return self._heights[2]
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        if self.count <= 5:
+            self._heights.append(x)
+            if self.count == 5:
+                self._heights.sort()
+            return
+
+        q = self._heights
+        n = self._positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = height
+                n[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q = self._heights
+        n = self._positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+
+class RouteLatency:
+    def __init__(self) -> None:
+        self.p50 = P2Quantile(0.5)
+        self.p95 = P2Quantile(0.95)
+        self.p99 = P2Quantile(0.99)
+
+    @property
+    def count(self) -> int:
+        return self.p50.count
+
+    def add(self, response_time: float) -> None:
+        self.p50.add(response_time)
+        self.p95.add(response_time)
+        self.p99.add(response_time)
+
+    def to_dict(self) -> RouteLatencyDict:
+        return {"count": self.count, "p50": self.p50.value, "p95": self.p95.value, "p99": self.p99.value}
+
+
+class LatencyTracker:
+    """
+    Tracks streaming p50/p95/p99 response time estimates per route template and flags requests slower than the
+    route's p99 so far, once enough requests to the route have been observed.
+    """
+
+    def __init__(self, min_samples: int = DEFAULT_MIN_SAMPLES, max_routes: int = MAX_TRACKED_ROUTES) -> None:
+        self.min_samples = min_samples
+        self.max_routes = max_routes
+        self._routes: dict[tuple[str, str], RouteLatency] = {}
+        self._lock = threading.Lock()
+
+    def update(self, method: str, path: str, response_time: float) -> bool:
+        """Add a response time for the route and return whether it is an outlier."""
+        key = (method.upper(), path)
+        with self._lock:
+            route = self._routes.get(key)
+            if route is None:
+                if len(self._routes) >= self.max_routes:
+                    return False
+                route = self._routes[key] = RouteLatency()
+            is_outlier = route.count >= self.min_samples and response_time > route.p99.value
+            route.add(response_time)
+            return is_outlier
+
+    def get(self, method: str, path: str) -> RouteLatencyDict | None:
+        with self._lock:
+            route = self._routes.get((method.upper(), path))
+            return route.to_dict() if route is not None else None
+
+    def snapshot(self) -> dict[str, RouteLatencyDict]:
+        """Return the current estimates for all routes, keyed by `"METHOD path"`."""
+        with self._lock:
+            return {f"{method} {path}": route.to_dict() for (method, path), route in self._routes.items()}
@@ -0,0 +1,89 @@
+import logging
+from contextvars import ContextVar, Token
+
+from apitally_serverless.common.output import LogRecordDict
+
+
+MAX_LOG_RECORDS = 100
+MAX_LOG_MSG_LENGTH = 2048
+# Total length of the messages included in a record, so the logs don't crowd out the rest of it
+MAX_LOGS_LENGTH = 8000
+
+_log_buffer: ContextVar["LogBuffer | None"] = ContextVar("apitally_log_buffer", default=None)
+_handler: "LogCaptureHandler | None" = None
+
+
+class LogBuffer:
+    """Preallocated ring buffer keeping the most recent log records emitted while handling a request."""
+
+    __slots__ = ("records", "count")
+
+    def __init__(self, size: int = MAX_LOG_RECORDS) -> None:
+        self.records: list[logging.LogRecord | None] = [None] * size
+        self.count = 0
+
+    def append(self, record: logging.LogRecord) -> None:
+        self.records[self.count % len(self.records)] = record
+        self.count += 1
+
+    def get_logs(self, max_length: int = MAX_LOGS_LENGTH) -> list[LogRecordDict]:
+        """
+        Format the buffered log records, oldest first. Formatting is deferred until the record is emitted.
+
+        The most recent records are kept if the total length of their messages would exceed `max_length`.
+        """
+        size = len(self.records)
+        start = max(0, self.count - size)
+        logs: list[LogRecordDict] = []
+        length = 0
+        for i in reversed(range(start, self.count)):
+            record = self.records[i % size]
+            if record is not None:
+                message = _get_truncated_message(record)
+                length += len(message)
+                if length > max_length:
+                    break
+                logs.append(
+                    {
+                        "timestamp": record.created,
+                        "logger": record.name,
+                        "level": record.levelname,
+                        "message": message,
+                    }
+                )
+        logs.reverse()
+        return logs
+
+
+class LogCaptureHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord) -> None:
+        buffer = _log_buffer.get()
+        if buffer is not None:
+            buffer.append(record)
+
+
+def setup_log_capture() -> None:
+    global _handler
+    if _handler is None:
+        _handler = LogCaptureHandler()
+        logging.getLogger().addHandler(_handler)
+
+
+def start_log_capture() -> tuple[LogBuffer, Token]:
+    buffer = LogBuffer()
+    return buffer, _log_buffer.set(buffer)
+
+
+def stop_log_capture(token: Token) -> None:
+    _log_buffer.reset(token)
+
+
+def _get_truncated_message(record: logging.LogRecord) -> str:
+    try:
+        msg = record.getMessage().strip()
+    except Exception:  # pragma: no cover
+        msg = str(record.msg)
+    if len(msg) <= MAX_LOG_MSG_LENGTH:
+        return msg
+    suffix = "... (truncated)"
+    return msg[: MAX_LOG_MSG_LENGTH - len(suffix)] + suffix
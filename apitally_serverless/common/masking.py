@@ -1,5 +1,9 @@
+import hashlib
 import json
 import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Any
 
 from apitally_serverless.common.config import ApitallyConfig
@@ -35,6 +39,75 @@ MASK_BODY_FIELD_PATTERNS = [
 ]
 
 
+@dataclass
+class MaskPlan:
+    """
+    Precomputed masking plan for a JSON value with a known schema.
+
+    `fields` holds the plans for the declared keys of an object and `items` the plan for array items or object
+    values. Values with an unknown schema (`fallback`) and undeclared object keys are masked using the regex patterns.
+    """
+
+    mask: bool = False
+    fields: dict[str, "MaskPlan"] | None = None
+    items: "MaskPlan | None" = None
+    fallback: bool = False
+
+
+CACHE_ENTRY_OVERHEAD = 128
+
+
+class MaskedBodyCache:
+    """
+    Bounded LRU cache of masked bodies, keyed by a hash of the content type, masking plan and raw body.
+
+    Bodies that masking leaves unchanged (e.g. invalid JSON) are stored as None, so they aren't parsed again.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[bytes, int], bytes | None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(body: bytes, content_type: str | None, plan: MaskPlan | None) -> tuple[bytes, int]:
+        h = hashlib.blake2b(digest_size=16)
+        h.update((content_type or "").encode())
+        h.update(b"\0")
+        h.update(body)
+        return h.digest(), id(plan)
+
+    def lookup(self, key: tuple[bytes, int]) -> tuple[bool, bytes | None]:
+        """Return whether the key was found and the masked body, which is None if masking didn't change it."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+
+    def put(self, key: tuple[bytes, int], masked: bytes | None) -> None:
+        entry_size = _get_entry_size(masked)
+        if entry_size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= _get_entry_size(self._entries.pop(key))
+            self._entries[key] = masked
+            self.size += entry_size
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= _get_entry_size(evicted)
+
+
+def _get_entry_size(masked: bytes | None) -> int:
+    return (len(masked) if masked is not None else 0) + CACHE_ENTRY_OVERHEAD
+
+
 class DataMasker:
     def __init__(self, config: ApitallyConfig) -> None:
         self.config = config
@@ -47,8 +120,14 @@ class DataMasker:
         self.mask_body_field_patterns = [
             re.compile(p, re.I) for p in dict.fromkeys(config.mask_body_fields + MASK_BODY_FIELD_PATTERNS)
         ]
+        self.body_cache = MaskedBodyCache(config.masked_body_cache_size) if config.masked_body_cache_size > 0 else None
 
-    def apply_masking(self, data: OutputDataDict) -> None:
+    def apply_masking(
+        self,
+        data: OutputDataDict,
+        request_body_plan: MaskPlan | None = None,
+        response_body_plan: MaskPlan | None = None,
+    ) -> None:
         request = data["request"]
         response = data["response"]
 
@@ -69,9 +148,9 @@ class DataMasker:
 
         # Mask request and response body fields
         if request["body"] is not None:
-            request["body"] = self._mask_body_bytes(request["body"], request["headers"])
+            request["body"] = self._mask_body_bytes(request["body"], request["headers"], request_body_plan)
         if response["body"] is not None:
-            response["body"] = self._mask_body_bytes(response["body"], response["headers"])
+            response["body"] = self._mask_body_bytes(response["body"], response["headers"], response_body_plan)
 
         # Mask request and response headers
         if self.config.log_request_headers and request["headers"] is not None:
@@ -96,8 +175,28 @@ class DataMasker:
     def _mask_headers(self, headers: list[tuple[str, str]]) -> list[tuple[str, str]]:
         return [(k, MASKED if self._should_mask_header(k) else v) for k, v in headers]
 
-    def _mask_body_bytes(self, body: bytes, headers: list[tuple[str, str]] | None) -> bytes:
+    def _mask_body_bytes(
+        self,
+        body: bytes,
+        headers: list[tuple[str, str]] | None,
+        plan: MaskPlan | None = None,
+    ) -> bytes:
         content_type = self._get_content_type(headers)
+        if content_type is not None and "json" not in content_type.lower():
+            # Masking never changes non-JSON bodies
+            return body
+        if self.body_cache is None:
+            return self._mask_body_bytes_uncached(body, content_type, plan)
+
+        key = self.body_cache.get_key(body, content_type, plan)
+        found, masked = self.body_cache.lookup(key)
+        if not found:
+            masked = self._mask_body_bytes_uncached(body, content_type, plan)
+            self.body_cache.put(key, masked if masked is not body else None)
+        return masked if masked is not None else body
+
+    def _mask_body_bytes_uncached(self, body: bytes, content_type: str | None, plan: MaskPlan | None) -> bytes:
+        mask_body = self._mask_body if plan is None else lambda data: self._mask_body_with_plan(data, plan)
 
         try:
             if content_type is not None and "ndjson" in content_type.lower():
@@ -108,14 +207,14 @@ class DataMasker:
                     if line:
                         try:
                             parsed = json.loads(line)
-                            masked = self._mask_body(parsed)
+                            masked = mask_body(parsed)
                             masked_lines.append(json.dumps(masked, separators=(",", ":")))
                         except (json.JSONDecodeError, UnicodeDecodeError):
                             masked_lines.append(line)
                 return "\n".join(masked_lines).encode("utf-8")
             elif content_type is None or "json" in content_type.lower():
                 parsed = json.loads(body.decode("utf-8"))
-                masked = self._mask_body(parsed)
+                masked = mask_body(parsed)
                 return json.dumps(masked, separators=(",", ":")).encode("utf-8")
         except (json.JSONDecodeError, UnicodeDecodeError):
             pass
@@ -135,6 +234,31 @@ class DataMasker:
             return [self._mask_body(item) for item in data]
         return data
 
+    def _mask_body_with_plan(self, data: Any, plan: MaskPlan) -> Any:
+        if isinstance(data, str):
+            return MASKED if plan.mask else data
+        if plan.fallback:
+            return self._mask_body(data)
+        if isinstance(data, dict):
+            if plan.fields is None and plan.items is None:
+                return self._mask_body(data)
+            result = {}
+            for key, value in data.items():
+                if plan.fields is not None and key in plan.fields:
+                    result[key] = self._mask_body_with_plan(value, plan.fields[key])
+                elif isinstance(value, str) and self._should_mask_body_field(key):
+                    result[key] = MASKED
+                elif plan.fields is None and plan.items is not None:
+                    result[key] = self._mask_body_with_plan(value, plan.items)
+                else:
+                    result[key] = self._mask_body(value)
+            return result
+        if isinstance(data, list):
+            if plan.items is None:
+                return self._mask_body(data)
+            return [self._mask_body_with_plan(item, plan.items) for item in data]
+        return data
+
     def _get_content_type(self, headers: list[tuple[str, str]] | None) -> str | None:
         if not headers:
             return None
@@ -1,11 +1,24 @@
 import base64
 import gzip
 import json
-from typing import Any, TypedDict
+import sys
+import threading
+from typing import Any, Callable, TypedDict
 
 from typing_extensions import NotRequired
 
 
+# Cloudflare Workers Logpush limits the total length of all exception and log messages to 16,384 characters,
+# so we need to keep the logged messages well below that limit.
+MAX_LOG_MESSAGE_LENGTH = 15_000
+LOG_MESSAGE_PREFIX = "apitally:"
+FRAGMENT_PREFIX = "apitally-fragment:"
+
+# Splitting large records into fragments is only useful with log sinks that don't limit the total length of all
+# messages per invocation (e.g. AWS Lambda), as the Logpush limit above applies to all fragments together.
+DEFAULT_MAX_SPLIT_RECORD_LENGTH = 60_000
+
+
 class ConsumerDict(TypedDict):
     identifier: str
     name: str | None
@@ -32,6 +45,9 @@ class ResponseDataDict(TypedDict):
     headers: list[tuple[str, str]] | None
     size: int | None
     body: bytes | None
+    time_to_first_byte: NotRequired[float | None]
+    time_to_last_byte: NotRequired[float | None]
+    chunk_count: NotRequired[int]
 
 
 class ValidationErrorDict(TypedDict):
@@ -46,6 +62,13 @@ class ExceptionDict(TypedDict):
     traceback: str
 
 
+class LogRecordDict(TypedDict):
+    timestamp: float
+    logger: str
+    level: str
+    message: str
+
+
 class OutputDataDict(TypedDict):
     instance_uuid: str
     request_uuid: str
@@ -56,6 +79,12 @@ class OutputDataDict(TypedDict):
     validation_errors: list[ValidationErrorDict] | None
     exception: ExceptionDict | None
     exclude: NotRequired[bool]
+    provisional: NotRequired[bool]
+    profile: NotRequired[str]
+    logs: NotRequired[list[LogRecordDict]]
+    capture_level: NotRequired[int]
+    sample_rate: NotRequired[float]
+    outlier: NotRequired[bool]
 
 
 def _json_default(obj: Any) -> Any:
@@ -72,22 +101,213 @@ def _skip_empty_values(data: dict[str, Any]) -> dict[str, Any]:
     }
 
 
-def _create_log_message(data: OutputDataDict) -> str:
+class StringTable:
+    """
+    Per-instance table of strings repeated across records (paths, header values and consumer identifiers).
+
+    The first occurrence of a value in an instance's stream is sent as `{"#": index, "v": value}` and later
+    occurrences as `{"#": index}`. The table is reset every `reset_interval` records, starting a new epoch, so a
+    decoder that misses a record can only lose references until the next reset.
+    """
+
+    def __init__(self, max_size: int = 256, reset_interval: int = 1000, min_length: int = 8) -> None:
+        self.max_size = max_size
+        self.reset_interval = reset_interval
+        self.min_length = min_length
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self._index: dict[str, int] = {}
+        self._pending: dict[str, int] = {}
+        self._records = 0
+
+    def encode(self, data: dict[str, Any]) -> dict[str, Any]:
+        """Return a copy of the cleaned data with repeated strings replaced. New entries are added on `commit`."""
+        self._pending = {}
+        encoded = _map_string_fields(data, self._encode_value)
+        encoded["string_table_epoch"] = self.epoch
+        return encoded
+
+    def commit(self) -> None:
+        self._index.update(self._pending)
+        self._pending = {}
+        self._records += 1
+        if self._records >= self.reset_interval:
+            self._index.clear()
+            self._records = 0
+            self.epoch += 1
+
+    def _encode_value(self, value: Any) -> Any:
+        if not isinstance(value, str) or len(value) < self.min_length:
+            return value
+        index = self._index.get(value, self._pending.get(value))
+        if index is not None:
+            return {"#": index}
+        index = len(self._index) + len(self._pending)
+        if index >= self.max_size:
+            return value
+        self._pending[value] = index
+        return {"#": index, "v": value}
+
+
+class UnresolvedReferenceError(ValueError):
+    """Raised when a record references a string table entry whose defining record was not received."""
+
+
+class StringTableDecoder:
+    """
+    Reference decoder for records encoded with a `StringTable`, keeping one table per instance.
+
+    Definitions in a record are learned even if the record itself can't be fully decoded, in which case
+    `UnresolvedReferenceError` is raised.
+    """
+
+    def __init__(self) -> None:
+        self.tables: dict[str, tuple[int, dict[int, str]]] = {}
+
+    def decode(self, data: dict[str, Any]) -> dict[str, Any]:
+        if "string_table_epoch" not in data:
+            return data
+        data = dict(data)
+        epoch = data.pop("string_table_epoch")
+        instance_uuid = data.get("instance_uuid", "")
+        current = self.tables.get(instance_uuid)
+        if current is None or current[0] != epoch:
+            current = (epoch, {})
+            self.tables[instance_uuid] = current
+        table = current[1]
+        unresolved: list[int] = []
+
+        def decode_value(value: Any) -> Any:
+            if isinstance(value, dict) and "#" in value:
+                if "v" in value:
+                    table[value["#"]] = value["v"]
+                    return value["v"]
+                if value["#"] not in table:
+                    unresolved.append(value["#"])
+                return table.get(value["#"])
+            return value
+
+        decoded = _map_string_fields(data, decode_value)
+        if unresolved:
+            raise UnresolvedReferenceError(f"Unresolved string table references: {unresolved}")
+        return decoded
+
+
+def _map_string_fields(data: dict[str, Any], fn: Callable[[Any], Any]) -> dict[str, Any]:
+    result = dict(data)
+    if "request" in data:
+        request = result["request"] = dict(data["request"])
+        for key in ("path", "consumer"):
+            if key in request:
+                request[key] = fn(request[key])
+        if "headers" in request:
+            request["headers"] = [(k, fn(v)) for k, v in request["headers"]]
+    if "response" in data and "headers" in data["response"]:
+        response = result["response"] = dict(data["response"])
+        response["headers"] = [(k, fn(v)) for k, v in response["headers"]]
+    if "consumer" in data and "identifier" in data["consumer"]:
+        result["consumer"] = {**data["consumer"], "identifier": fn(data["consumer"]["identifier"])}
+    return result
+
+
+def _create_log_message(data: OutputDataDict, string_table: StringTable | None = None) -> str:
     cleaned = _skip_empty_values(dict(data))
+    if string_table is not None:
+        cleaned = string_table.encode(cleaned)
     serialized = json.dumps(cleaned, separators=(",", ":"), default=_json_default)
     compressed = gzip.compress(serialized.encode("utf-8"))
     encoded = base64.b64encode(compressed).decode("ascii")
-    return f"apitally:{encoded}"
+    return f"{LOG_MESSAGE_PREFIX}{encoded}"
+
+
+def decode_log_message(msg: str) -> dict[str, Any]:
+    """Decode a log message created by `_create_log_message` back into a (cleaned) data dict."""
+    encoded = msg.removeprefix(LOG_MESSAGE_PREFIX).strip()
+    decompressed = gzip.decompress(base64.b64decode(encoded))
+    return json.loads(decompressed.decode("utf-8"))
+
+
+def _create_log_fragments(msg: str, request_uuid: str, max_length: int) -> list[str] | None:
+    """Split a log message into fragments, unless their combined length would exceed `max_length`."""
+    payload = msg.removeprefix(LOG_MESSAGE_PREFIX)
+    max_total = max_length // MAX_LOG_MESSAGE_LENGTH + 1
+    header_length = len(f"{FRAGMENT_PREFIX}{request_uuid}:{max_total}:{max_total}:")
+    chunk_size = MAX_LOG_MESSAGE_LENGTH - header_length
+    total = -(-len(payload) // chunk_size)
+    fragments = [
+        f"{FRAGMENT_PREFIX}{request_uuid}:{i}:{total}:{payload[i * chunk_size : (i + 1) * chunk_size]}"
+        for i in range(total)
+    ]
+    if sum(len(f) for f in fragments) > max_length:
+        return None
+    return fragments
+
+
+class FragmentReassembler:
+    """Reference reassembler for records split across multiple `apitally-fragment:` log messages."""
+
+    def __init__(self) -> None:
+        self.pending: dict[str, list[str | None]] = {}
+
+    def feed(self, msg: str) -> str | None:
+        """Add a fragment and return the reassembled log message once all fragments of a record are received."""
+        request_uuid, index, total, chunk = msg.removeprefix(FRAGMENT_PREFIX).split(":", 3)
+        chunks = self.pending.setdefault(request_uuid, [None] * int(total))
+        chunks[int(index)] = chunk.strip()
+        if any(c is None for c in chunks):
+            return None
+        del self.pending[request_uuid]
+        return LOG_MESSAGE_PREFIX + "".join(c for c in chunks if c is not None)
+
+
+def log_data(data: OutputDataDict, max_split_length: int = 0, string_table: StringTable | None = None) -> None:
+    """
+    Log the record, trimming logs and dropping bodies if it's too long. If `max_split_length` is greater than the message
+    length limit, records up to that total length are split into fragments instead.
+    """
+    if string_table is None:
+        _log_data(data, max_split_length)
+        return
+
+    # Encoding and printing must happen atomically, so definitions always precede references in the output
+    with string_table.lock:
+        _log_data(data, max_split_length, string_table)
+        string_table.commit()
+
+
+def _log_data(data: OutputDataDict, max_split_length: int, string_table: StringTable | None = None) -> None:
+    msg = _create_log_message(data, string_table)
+
+    if len(msg) > MAX_LOG_MESSAGE_LENGTH:
+        fragments = (
+            _create_log_fragments(msg, data["request_uuid"], max_split_length)
+            if max_split_length > MAX_LOG_MESSAGE_LENGTH
+            else None
+        )
+        if fragments is not None:
+            _write_lines(fragments)
+            return
+
+        # Drop the oldest half of the captured logs at a time, before dropping any bodies
+        while len(msg) > MAX_LOG_MESSAGE_LENGTH and data.get("logs"):
+            logs = data["logs"]
+            data["logs"] = logs[len(logs) // 2 + len(logs) % 2 :]
+            msg = _create_log_message(data, string_table)
+
+        if len(msg) > MAX_LOG_MESSAGE_LENGTH:
+            data["request"]["body"] = None
+            data["response"]["body"] = None
+            msg = _create_log_message(data, string_table)
+
+    _write_lines([msg])
 
 
-def log_data(data: OutputDataDict) -> None:
-    msg = _create_log_message(data)
+_output_lock = threading.Lock()
 
-    if len(msg) > 15_000:
-        # Cloudflare Workers Logpush limits the total length of all exception and log messages to 16,384 characters,
-        # so we need to keep the logged message well below that limit.
-        data["request"]["body"] = None
-        data["response"]["body"] = None
-        msg = _create_log_message(data)
 
-    print(msg)
+def _write_lines(lines: list[str]) -> None:
+    # Records may be logged from several threads at once. `print` writes the text and the newline separately, so
+    # each line is written in a single call, and the lines of a fragmented record are kept together.
+    with _output_lock:
+        for line in lines:
+            sys.stdout.write(line + "\n")
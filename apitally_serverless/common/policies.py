@@ -0,0 +1,49 @@
+from dataclasses import dataclass, replace
+
+from apitally_serverless.common.config import ApitallyConfig, ApitallyRoutePolicy
+from apitally_serverless.common.masking import DataMasker
+
+
+@dataclass
+class ResolvedPolicy:
+    config: ApitallyConfig
+    masker: DataMasker
+
+
+class RoutePolicyIndex:
+    """Per-route capture policies, compiled once and looked up by method and route path."""
+
+    def __init__(self, config: ApitallyConfig) -> None:
+        self.default = ResolvedPolicy(config, DataMasker(config))
+        self._policies: dict[tuple[str | None, str], ResolvedPolicy] = {}
+        for policy in config.route_policies:
+            method = policy.method.upper() if policy.method else None
+            route_config = _apply_route_policy(config, policy)
+            self._policies[(method, policy.path)] = ResolvedPolicy(route_config, DataMasker(route_config))
+
+    def lookup(self, method: str, path: str | None) -> ResolvedPolicy:
+        if path is None or not self._policies:
+            return self.default
+        return self._policies.get((method, path)) or self._policies.get((None, path)) or self.default
+
+
+def _apply_route_policy(config: ApitallyConfig, policy: ApitallyRoutePolicy) -> ApitallyConfig:
+    overrides = {
+        k: getattr(policy, k)
+        for k in (
+            "log_request_headers",
+            "log_request_body",
+            "log_response_headers",
+            "log_response_body",
+            "max_body_size",
+            "profile_slow_threshold",
+        )
+        if getattr(policy, k) is not None
+    }
+    return replace(
+        config,
+        **overrides,
+        mask_headers=config.mask_headers + policy.mask_headers,
+        mask_body_fields=config.mask_body_fields + policy.mask_body_fields,
+        route_policies=[],
+    )
@@ -0,0 +1,154 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Any
+
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 32
+MAX_DISTINCT_STACKS = 256
+MAX_PROFILE_LENGTH = 2048
+# Requests are only sampled once they have been running for this fraction of their slow threshold
+SAMPLING_DELAY_RATIO = 0.5
+
+
+class RequestProfile:
+    def __init__(
+        self, task: asyncio.Task, loop: asyncio.AbstractEventLoop, thread_id: int, sample_after: float = 0.0
+    ) -> None:
+        self.task = task
+        self.loop = loop
+        self.thread_id = thread_id
+        self.sample_after = sample_after
+        self.samples: Counter[str] = Counter()
+
+    def add_sample(self, stack: str) -> None:
+        if stack in self.samples or len(self.samples) < MAX_DISTINCT_STACKS:
+            self.samples[stack] += 1
+
+    def get_folded_stacks(self, max_length: int = MAX_PROFILE_LENGTH) -> str | None:
+        """Return the samples in folded-stack format (`frame;frame;frame count`), most frequent first."""
+        lines = []
+        length = 0
+        for stack, count in self.samples.most_common():
+            line = f"{stack} {count}"
+            if length + len(line) + 1 > max_length:
+                break
+            lines.append(line)
+            length += len(line) + 1
+        return "\n".join(lines) or None
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the Python stacks of the asyncio tasks handling profiled requests from a background thread.
+
+    Samples of a task that is running on its event loop are taken from the thread's current frame, while samples
+    of a suspended task are taken from its chain of awaited coroutines. Sync endpoints run in a thread pool, so
+    only their `run_in_threadpool` await chain is captured, not the frames of the handler itself.
+
+    Requests are only sampled once they have been running for a fraction of their slow threshold, so requests that
+    complete quickly are never sampled and the background thread stays idle while there are none.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.available = True
+        self._profiles: set[RequestProfile] = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, threshold: float = 0.0) -> RequestProfile | None:
+        if not self.available:
+            return None
+        task = asyncio.current_task()
+        if task is None:  # pragma: no cover
+            return None
+        if not self._ensure_thread():
+            return None
+        sample_after = time.monotonic() + threshold * SAMPLING_DELAY_RATIO
+        profile = RequestProfile(task, task.get_loop(), threading.get_ident(), sample_after)
+        with self._lock:
+            self._profiles.add(profile)
+        self._wakeup.set()
+        self._started.set()
+        return profile
+
+    def stop(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _ensure_thread(self) -> bool:
+        if self._thread is not None:
+            return True
+        thread = threading.Thread(target=self._run, name="apitally-profiler", daemon=True)
+        try:
+            thread.start()
+        except RuntimeError:  # pragma: no cover
+            # Threads are not available, e.g. in Cloudflare Workers
+            self.available = False
+            return False
+        self._thread = thread
+        return True
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._wakeup.clear()
+                    continue
+                self._started.clear()
+            now = time.monotonic()
+            due = [p for p in profiles if p.sample_after <= now]
+            if due:
+                self._sample(due)
+                time.sleep(self.interval)
+            else:
+                # Stay idle until the first request becomes due for sampling, or another one is started
+                self._started.wait(min(p.sample_after for p in profiles) - now)
+
+    def _sample(self, profiles: list[RequestProfile]) -> None:
+        frames = sys._current_frames()
+        for profile in profiles:
+            if profile.task.done():
+                continue
+            if asyncio.current_task(profile.loop) is profile.task:
+                frame = frames.get(profile.thread_id)
+                stack = _get_frame_stack(frame) if frame is not None else []
+            else:
+                stack = _get_coroutine_stack(profile.task.get_coro())
+            if stack:
+                profile.add_sample(";".join(stack[-MAX_STACK_DEPTH:]))
+
+
+def _format_frame(frame: FrameType) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def _get_frame_stack(frame: FrameType | None) -> list[str]:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH * 4:
+        stack.append(_format_frame(frame))
+        frame = frame.f_back
+    return stack[::-1]
+
+
+def _get_coroutine_stack(coro: Any) -> list[str]:
+    stack = []
+    while coro is not None and len(stack) < MAX_STACK_DEPTH * 4:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is not None:
+            stack.append(_format_frame(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,88 @@
+import threading
+import weakref
+from dataclasses import fields, is_dataclass, replace
+from typing import Any, Callable, Hashable, TypeVar
+
+from apitally_serverless.common.config import ApitallyConfig
+
+
+T = TypeVar("T")
+
+
+class CompiledStateRegistry:
+    """
+    Process-wide cache of state compiled from the config or the wrapped app, such as maskers and route indexes, so
+    that middleware instances with identical configurations share one compiled instance.
+
+    Entries tied to an owner object (e.g. an app) are removed when the owner is garbage collected. Call `invalidate`
+    to force recompilation, e.g. after reloading code in place.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple[str, Hashable], Any] = {}
+        self._lock = threading.RLock()
+
+    def get(self, namespace: str, key: Hashable, factory: Callable[[], T], owner: object | None = None) -> T:
+        if owner is not None:
+            key = (key, id(owner))
+        entry_key = (namespace, key)
+        with self._lock:
+            if entry_key in self._entries:
+                return self._entries[entry_key]
+            value = factory()
+            if owner is not None:
+                try:
+                    weakref.finalize(owner, self._remove, entry_key)
+                except TypeError:
+                    # The owner can't be referenced weakly, so its id could be reused after it is gone
+                    return value
+            self._entries[entry_key] = value
+            return value
+
+    def invalidate(self, namespace: str | None = None) -> None:
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+            else:
+                for entry_key in [k for k in self._entries if k[0] == namespace]:
+                    del self._entries[entry_key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, entry_key: tuple[str, Hashable]) -> None:
+        with self._lock:
+            self._entries.pop(entry_key, None)
+
+
+def without_callables(config: ApitallyConfig) -> ApitallyConfig:
+    """
+    Return a copy of the config with callable fields (e.g. schedulers and resolvers) cleared.
+
+    Compiled state doesn't depend on them, and keying it by callables would create a new entry for every fresh
+    closure that is never freed.
+    """
+    changes = {f.name: None for f in fields(config) if callable(getattr(config, f.name))}
+    return replace(config, **changes) if changes else config
+
+
+def freeze(value: Any) -> Hashable:
+    """Convert a config value into a hashable key. Raises `TypeError` if that's not possible."""
+    if is_dataclass(value) and not isinstance(value, type):
+        return (type(value), tuple(freeze(getattr(value, f.name)) for f in fields(value)))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple((k, freeze(v)) for k, v in value.items())
+    hash(value)
+    return value
+
+
+compiled_state_registry = CompiledStateRegistry()
+
+
+def invalidate_compiled_state() -> None:
+    """Discard all shared compiled state, so that middleware instances created afterwards compile it again."""
+    compiled_state_registry.invalidate()
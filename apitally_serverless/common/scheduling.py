@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, MutableMapping
+
+
+# Called with the ASGI scope of the request, so per-invocation context (e.g. the `ctx` of a Cloudflare Worker) can
+# be looked up, and the callback that builds and logs the record.
+FinalizeScheduler = Callable[[MutableMapping[str, Any], Callable[[], None]], Any]
+WaitUntil = Callable[[Awaitable[None]], Any]
+
+
+def asyncio_scheduler(scope: MutableMapping[str, Any], callback: Callable[[], None]) -> None:
+    """
+    Run the callback on the running event loop once the current request handler has returned.
+
+    This is only suitable for long-running servers, as serverless runtimes may freeze or terminate the invocation
+    once the response has been sent. Use `wait_until_scheduler` there instead.
+    """
+    asyncio.get_running_loop().call_soon(callback)
+
+
+def wait_until_scheduler(get_wait_until: Callable[[MutableMapping[str, Any]], WaitUntil | None]) -> FinalizeScheduler:
+    """
+    Create a scheduler that hands finalization to the runtime's per-invocation `waitUntil`, which keeps the
+    invocation alive until the returned awaitable has completed.
+
+    `get_wait_until` is called with the scope of each request and returns its `waitUntil` function (e.g.
+    `lambda scope: scope["ctx"].waitUntil`), or None to finalize inline.
+    """
+
+    def schedule(scope: MutableMapping[str, Any], callback: Callable[[], None]) -> None:
+        wait_until = get_wait_until(scope)
+        if wait_until is None:
+            callback()
+            return
+
+        async def run() -> None:
+            callback()
+
+        wait_until(run())
+
+    return schedule
+
+
+class FinalizeExecutor:
+    """
+    Bounded thread pool for finalizing records with large payloads off the event loop thread.
+
+    At most `max_workers + max_queue_size` callbacks are running or queued at any time. When the pool is full,
+    `submit` returns None and the caller finalizes inline, which slows it down instead of queueing without bound.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue_size: int = 32) -> None:
+        self.max_workers = max_workers
+        self.available = True
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        self._executor: ThreadPoolExecutor | None = None
+
+    def submit(self, callback: Callable[[], None]) -> Future | None:
+        if not self.available or not self._slots.acquire(blocking=False):
+            return None
+
+        def run() -> None:
+            try:
+                callback()
+            finally:
+                self._slots.release()
+
+        try:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="apitally-finalize")
+            return self._executor.submit(run)
+        except RuntimeError:  # pragma: no cover
+            # Threads are not available, e.g. in Cloudflare Workers
+            self.available = False
+            self._slots.release()
+            return None
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
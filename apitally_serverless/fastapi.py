@@ -1,8 +1,37 @@
+from dataclasses import replace
+from datetime import date, time, timedelta
+from decimal import Decimal
+from enum import Enum
+from types import NoneType, UnionType
+from typing import Annotated, Any, Union, get_args, get_origin
+from uuid import UUID
+
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, SecretBytes, SecretStr
+from starlette.routing import BaseRoute
+
+from apitally_serverless.common.masking import DataMasker, MaskPlan
 from apitally_serverless.starlette import ApitallyMiddleware as _ApitallyMiddlewareForStarlette
-from apitally_serverless.starlette import set_consumer
+from apitally_serverless.starlette import (
+    ApitallyRoutePolicy,
+    configure_capture_budget,
+    get_latency_tracker,
+    invalidate_compiled_state,
+    set_consumer,
+)
+
 
+__all__ = [
+    "ApitallyMiddleware",
+    "ApitallyRoutePolicy",
+    "configure_capture_budget",
+    "get_latency_tracker",
+    "invalidate_compiled_state",
+    "set_consumer",
+]
 
-__all__ = ["ApitallyMiddleware", "set_consumer"]
+PRIMITIVE_TYPES = (str, int, float, bool, bytes, Enum, UUID, Decimal, date, time, timedelta)
+SEQUENCE_TYPES = (list, tuple, set, frozenset)
 
 
 class ApitallyMiddleware(_ApitallyMiddlewareForStarlette):
@@ -14,4 +43,45 @@ class ApitallyMiddleware(_ApitallyMiddlewareForStarlette):
     - Reference: https://docs.apitally.io/reference/python-serverless
     """
 
-    pass
+    def _build_body_mask_plans(self, route: BaseRoute, masker: DataMasker) -> tuple[MaskPlan | None, MaskPlan | None]:
+        if not isinstance(route, APIRoute):
+            return None, None
+        body_field = route.body_field
+        request_body_plan = _build_mask_plan(body_field.field_info.annotation, masker) if body_field else None
+        response_body_plan = _build_mask_plan(route.response_model, masker) if route.response_model else None
+        return request_body_plan, response_body_plan
+
+
+def _build_mask_plan(annotation: Any, masker: DataMasker, seen: frozenset[type] = frozenset()) -> MaskPlan:
+    origin = get_origin(annotation)
+    args = get_args(annotation)
+
+    if origin is Annotated:
+        return _build_mask_plan(args[0], masker, seen)
+    if origin in (Union, UnionType):
+        members = [a for a in args if a is not NoneType]
+        if len(members) == 1:
+            return _build_mask_plan(members[0], masker, seen)
+        return MaskPlan(fallback=True)
+    if origin in SEQUENCE_TYPES:
+        if origin is tuple and not (len(args) == 2 and args[1] is Ellipsis):
+            return MaskPlan(fallback=True)
+        return MaskPlan(items=_build_mask_plan(args[0], masker, seen)) if args else MaskPlan(fallback=True)
+    if origin is dict:
+        return MaskPlan(items=_build_mask_plan(args[1], masker, seen)) if len(args) == 2 else MaskPlan(fallback=True)
+    if not isinstance(annotation, type):
+        return MaskPlan(fallback=True)
+    if issubclass(annotation, (SecretStr, SecretBytes)):
+        return MaskPlan(mask=True)
+    if issubclass(annotation, BaseModel):
+        if annotation in seen:
+            return MaskPlan(fallback=True)
+        fields: dict[str, MaskPlan] = {}
+        for name, field_info in annotation.model_fields.items():
+            plan = _build_mask_plan(field_info.annotation, masker, seen | {annotation})
+            for key in dict.fromkeys([name, field_info.alias or name, field_info.serialization_alias or name]):
+                fields[key] = replace(plan, mask=True) if masker._should_mask_body_field(key) else plan
+        return MaskPlan(fields=fields)
+    if annotation is NoneType or issubclass(annotation, PRIMITIVE_TYPES):
+        return MaskPlan()
+    return MaskPlan(fallback=True)
@@ -0,0 +1,303 @@
+"""
+Replay captured Apitally log lines through `ApitallyMiddleware` to reproduce performance issues locally.
+
+Usage: python -m apitally_serverless.replay [options] [FILE ...]
+
+Each input line is scanned for `apitally:` messages (raw log output or Logpush JSON), which are decoded and turned
+into equivalent ASGI requests against a stub app that responds with the recorded status, headers and body.
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import fileinput
+import re
+import sys
+import time
+import zlib
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Sequence
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.types import ASGIApp, Message, Scope
+from typing_extensions import Unpack
+
+from apitally_serverless.common.config import ApitallyConfigKwargs
+from apitally_serverless.common.output import (
+    FRAGMENT_PREFIX,
+    FragmentReassembler,
+    StringTableDecoder,
+    UnresolvedReferenceError,
+    decode_log_message,
+)
+from apitally_serverless.starlette import ApitallyMiddleware
+
+
+__all__ = ["ReplayReport", "iter_log_messages", "iter_records", "main", "replay"]
+
+LOG_MESSAGE_PATTERN = re.compile(r"apitally:[A-Za-z0-9+/=]+|apitally-fragment:[0-9a-f-]+:\d+:\d+:[A-Za-z0-9+/=]+")
+PATH_PARAM_PATTERN = re.compile(r"\{[^}]+\}")
+EXCLUDED_RESPONSE_HEADERS = {"content-length", "content-encoding", "transfer-encoding"}
+HTTP_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE"]
+
+
+class ReplayError(Exception):
+    pass
+
+
+@dataclass
+class ReplayReport:
+    records: int = 0
+    exceptions: int = 0
+    elapsed: float = 0.0
+    emitted_bytes: int = 0
+    emitted_lines: int = 0
+    overheads: list[float] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        return self.records / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def emitted_bytes_per_record(self) -> float:
+        return self.emitted_bytes / self.records if self.records > 0 else 0.0
+
+    def overhead_percentile(self, p: float) -> float:
+        if not self.overheads:
+            return 0.0
+        values = sorted(self.overheads)
+        index = min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))
+        return values[index]
+
+    def format(self) -> str:
+        lines = [
+            f"Records replayed:        {self.records} ({self.exceptions} with exceptions)",
+            f"Elapsed:                 {self.elapsed:.3f} s",
+            f"Throughput:              {self.throughput:.1f} req/s",
+        ]
+        if self.overheads:
+            lines += [f"Overhead p{p:<2}:            {self.overhead_percentile(p) * 1000:.3f} ms" for p in (50, 90, 99)]
+        lines += [
+            f"Emitted lines:           {self.emitted_lines}",
+            f"Emitted bytes/record:    {self.emitted_bytes_per_record:.1f}",
+        ]
+        return "\n".join(lines)
+
+
+class _CountingWriter:
+    def __init__(self) -> None:
+        self.bytes = 0
+        self.lines = 0
+
+    def write(self, s: str) -> int:
+        self.bytes += len(s)
+        self.lines += s.count("\n")
+        return len(s)
+
+    def flush(self) -> None:
+        pass
+
+
+def iter_log_messages(lines: Iterable[str]) -> Iterator[str]:
+    """Extract all `apitally:` messages from the given lines, reassembling fragmented records."""
+    reassembler = FragmentReassembler()
+    for line in lines:
+        if "apitally" not in line:
+            continue
+        for msg in LOG_MESSAGE_PATTERN.findall(line):
+            if msg.startswith(FRAGMENT_PREFIX):
+                reassembled = reassembler.feed(msg)
+                if reassembled is not None:
+                    yield reassembled
+            else:
+                yield msg
+
+
+def iter_records(lines: Iterable[str]) -> Iterator[dict[str, Any]]:
+    """
+    Decode all `apitally:` messages in the given lines, skipping any that can't be decoded, including records that
+    reference string table entries defined in lines that are missing.
+    """
+    string_table = StringTableDecoder()
+    for msg in iter_log_messages(lines):
+        try:
+            data = string_table.decode(decode_log_message(msg))
+        except (binascii.Error, OSError, EOFError, zlib.error, UnresolvedReferenceError, ValueError):
+            continue
+        yield data
+
+
+def replay(
+    records: Iterable[dict[str, Any]],
+    concurrency: int = 10,
+    baseline: bool = True,
+    **kwargs: Unpack[ApitallyConfigKwargs],
+) -> ReplayReport:
+    """Replay decoded records through `ApitallyMiddleware` configured with the given kwargs."""
+    return asyncio.run(_replay(records, concurrency=concurrency, baseline=baseline, config_kwargs=kwargs))
+
+
+async def _replay(
+    records: Iterable[dict[str, Any]],
+    concurrency: int,
+    baseline: bool,
+    config_kwargs: ApitallyConfigKwargs,
+) -> ReplayReport:
+    report = ReplayReport()
+    bare_app = _create_stub_app()
+    wrapped_app = _create_stub_app(middleware=[Middleware(ApitallyMiddleware, **config_kwargs)])
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks: set[asyncio.Task] = set()
+    writer = _CountingWriter()
+
+    async def run(record: dict[str, Any]) -> None:
+        try:
+            scope, body = _build_request(record)
+            bare_time = await _call(bare_app, scope, body) if baseline else 0.0
+            wrapped_time = await _call(wrapped_app, scope, body)
+            if baseline:
+                report.overheads.append(max(0.0, wrapped_time - bare_time))
+            if record.get("exception"):
+                report.exceptions += 1
+        finally:
+            report.records += 1
+            semaphore.release()
+
+    start_time = time.perf_counter()
+    with redirect_stdout(writer):
+        for record in records:
+            await semaphore.acquire()
+            task = asyncio.create_task(run(record))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    report.elapsed = time.perf_counter() - start_time
+    report.emitted_bytes = writer.bytes
+    report.emitted_lines = writer.lines
+    return report
+
+
+async def _call(app: ASGIApp, scope: Scope, body: bytes) -> float:
+    request_sent = False
+    disconnected = asyncio.Event()
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}  # pragma: no cover
+
+    async def send(message: Message) -> None:
+        pass
+
+    start_time = time.perf_counter()
+    try:
+        await app(dict(scope), receive, send)
+    except ReplayError:
+        pass
+    finally:
+        disconnected.set()
+    return time.perf_counter() - start_time
+
+
+def _create_stub_app(middleware: Sequence[Middleware] | None = None) -> Starlette:
+    async def endpoint(request: Request) -> Response:
+        record: dict[str, Any] = request.scope["apitally_replay"]
+        if record.get("exception"):
+            raise ReplayError(record["exception"].get("msg", ""))
+        response = record.get("response", {})
+        headers = {k: v for k, v in response.get("headers", []) if k not in EXCLUDED_RESPONSE_HEADERS}
+        return Response(
+            content=_get_body(response),
+            status_code=response.get("status_code") or 200,
+            headers=headers,
+        )
+
+    return Starlette(routes=[Route("/{path:path}", endpoint, methods=HTTP_METHODS)], middleware=middleware)
+
+
+def _build_request(record: dict[str, Any]) -> tuple[Scope, bytes]:
+    request = record.get("request", {})
+    body = _get_body(request)
+    path = PATH_PARAM_PATTERN.sub("0", request.get("path") or "/")
+    headers = [
+        (k.lower().encode("latin-1", "replace"), v.encode("latin-1", "replace")) for k, v in request.get("headers", [])
+    ]
+    if not any(k == b"content-length" for k, _ in headers) and body:
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    scope: Scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST" if body else "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+        "apitally_replay": record,
+    }
+    return scope, body
+
+
+def _get_body(data: dict[str, Any]) -> bytes:
+    if data.get("body"):
+        try:
+            return base64.b64decode(data["body"])
+        except (binascii.Error, ValueError):
+            pass
+    return b" " * (data.get("size") or 0)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m apitally_serverless.replay",
+        description="Replay captured Apitally log lines through ApitallyMiddleware.",
+    )
+    parser.add_argument("files", nargs="*", help="log files to read (default: stdin)")
+    parser.add_argument("-c", "--concurrency", type=int, default=10, help="number of concurrent requests")
+    parser.add_argument("-n", "--limit", type=int, default=None, help="maximum number of records to replay")
+    parser.add_argument(
+        "--baseline",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="also replay each request without middleware to measure overhead",
+    )
+    parser.add_argument("--log-request-headers", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--log-request-body", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--log-response-headers", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--log-response-body", action=argparse.BooleanOptionalAction, default=True)
+    args = parser.parse_args(argv)
+
+    with fileinput.input(files=args.files or ("-",), encoding="utf-8", errors="replace") as lines:
+        records: Iterable[dict[str, Any]] = iter_records(lines)
+        if args.limit is not None:
+            records = (r for _, r in zip(range(args.limit), records))
+        report = replay(
+            records,
+            concurrency=args.concurrency,
+            baseline=args.baseline,
+            log_request_headers=args.log_request_headers,
+            log_request_body=args.log_request_body,
+            log_response_headers=args.log_response_headers,
+            log_response_body=args.log_response_body,
+        )
+
+    print(report.format())
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -1,10 +1,16 @@
+import asyncio
 import json
 import sys
 import time
+from concurrent.futures import Future
 from contextlib import suppress
+from dataclasses import dataclass, field
+from functools import partial
 from importlib.metadata import PackageNotFoundError, version
+from typing import Callable, Hashable, TypeVar
 from uuid import uuid4
 
+from starlette.applications import Starlette
 from starlette.datastructures import Headers
 from starlette.requests import Request
 from starlette.routing import BaseRoute, Match, Router
@@ -12,28 +18,51 @@ from starlette.schemas import SchemaGenerator
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from typing_extensions import Unpack
 
-from apitally_serverless.common.config import ApitallyConfig, ApitallyConfigKwargs
-from apitally_serverless.common.consumers import ApitallyConsumer
+from apitally_serverless.common.budget import body_capture_budget, configure_capture_budget
+from apitally_serverless.common.config import ApitallyConfig, ApitallyConfigKwargs, ApitallyRoutePolicy
+from apitally_serverless.common.consumers import ApitallyConsumer, ConsumerResolverCache
+from apitally_serverless.common.encoding import BodyDecoder, create_body_decoder, is_identity_encoding
 from apitally_serverless.common.exceptions import (
     get_exception_type,
     get_truncated_exception_msg,
     get_truncated_exception_traceback,
 )
+from apitally_serverless.common.governor import CaptureLevel, OverheadGovernor
 from apitally_serverless.common.headers import convert_headers, is_supported_content_type, parse_content_length
-from apitally_serverless.common.masking import DataMasker
+from apitally_serverless.common.latency import LatencyTracker
+from apitally_serverless.common.log_capture import LogBuffer, setup_log_capture, start_log_capture, stop_log_capture
+from apitally_serverless.common.masking import DataMasker, MaskPlan
 from apitally_serverless.common.output import (
     OutputDataDict,
     StartupDataDict,
+    StringTable,
     ValidationErrorDict,
     log_data,
 )
+from apitally_serverless.common.policies import ResolvedPolicy, RoutePolicyIndex
+from apitally_serverless.common.profiler import RequestProfile, sampling_profiler
+from apitally_serverless.common.registry import (
+    compiled_state_registry,
+    freeze,
+    invalidate_compiled_state,
+    without_callables,
+)
+from apitally_serverless.common.scheduling import FinalizeExecutor
 
 
-__all__ = ["ApitallyMiddleware", "set_consumer"]
+__all__ = [
+    "ApitallyMiddleware",
+    "ApitallyRoutePolicy",
+    "configure_capture_budget",
+    "get_latency_tracker",
+    "invalidate_compiled_state",
+    "set_consumer",
+]
 
-MAX_BODY_SIZE = 10_000
 BODY_TOO_LARGE = b"<body too large>"
 
+T = TypeVar("T")
+
 
 class ApitallyMiddleware:
     """
@@ -51,9 +80,52 @@ class ApitallyMiddleware:
     ) -> None:
         self.app = app
         self.config = ApitallyConfig.from_kwargs(kwargs)
-        self.masker = DataMasker(self.config)
+        compiled_config = without_callables(self.config)
+        try:
+            self.config_key: Hashable | None = freeze(compiled_config)
+        except TypeError:
+            self.config_key = None
+        self.policies = self._get_compiled("policies", partial(RoutePolicyIndex, compiled_config))
+        self.masker = self.policies.default.masker
         self.instance_uuid = str(uuid4())
         self.is_first_request = True
+        self.body_mask_plans: dict[tuple[int, int], tuple[MaskPlan | None, MaskPlan | None]] = self._get_compiled(
+            f"body_mask_plans:{type(self).__qualname__}", dict, owner=app
+        )
+        self.governor = (
+            OverheadGovernor(
+                overhead_budget=self.config.overhead_budget,
+                max_in_flight=self.config.max_in_flight,
+                sample_rate=self.config.governor_sample_rate,
+            )
+            if self.config.overhead_budget is not None or self.config.max_in_flight is not None
+            else None
+        )
+        self.string_table = (
+            StringTable(self.config.string_table_size, self.config.string_table_reset_interval)
+            if self.config.string_table_size > 0
+            else None
+        )
+        self.finalize_executor = (
+            FinalizeExecutor(self.config.finalize_executor_workers, self.config.finalize_executor_queue_size)
+            if self.config.finalize_executor_threshold is not None
+            else None
+        )
+        self.latency_tracker = (
+            LatencyTracker(min_samples=self.config.latency_min_samples) if self.config.latency_tracking else None
+        )
+        if self.config.capture_logs:
+            setup_log_capture()
+        self.consumer_resolver = (
+            ConsumerResolverCache(
+                self.config.consumer_resolver,
+                credential_headers=self.config.consumer_credential_headers,
+                max_size=self.config.consumer_cache_size,
+                ttl=self.config.consumer_cache_ttl,
+            )
+            if self.config.consumer_resolver is not None
+            else None
+        )
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if not self.config.enabled or scope["type"] != "http" or scope["method"] == "OPTIONS":  # pragma: no cover
@@ -61,138 +133,360 @@ class ApitallyMiddleware:
             return
 
         start_time = time.perf_counter()
+        # The governor's overhead is measured in CPU time of the middleware's own synchronous sections, so that
+        # time spent waiting for the GIL or the event loop under load isn't attributed to the middleware
+        cpu_start_time = time.thread_time()
+        capture_level = self.governor.enter() if self.governor is not None else CaptureLevel.FULL
+        if capture_level == CaptureLevel.SAMPLED and self.governor is not None and not self.governor.should_sample():
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.governor.exit()
+                self.governor.record(0.0, time.perf_counter() - start_time)
+            return
+
         request = Request(scope, receive, send)
-        request_size = parse_content_length(request.headers.get("Content-Length"))
-        request_content_type = request.headers.get("Content-Type")
-        request_body = b""
-        request_body_too_large = request_size is not None and request_size > MAX_BODY_SIZE
-
-        response_status = 0
-        response_time: float | None = None
-        response_headers = Headers()
-        response_body = b""
-        response_body_too_large = False
-        response_size: int | None = None
+        if self.latency_tracker is not None:
+            request.state.apitally_latency_tracker = self.latency_tracker
+        route, request_path = _get_route(scope, routes=_get_routes(scope.get("app") or self.app))
+        policy = self.policies.lookup(scope["method"], request_path)
+        config = policy.config
+        max_body_size = config.max_body_size
+        capture = _RequestCapture(
+            request=request,
+            route=route,
+            path=request_path,
+            policy=policy,
+            capture_level=capture_level,
+            request_size=parse_content_length(request.headers.get("Content-Length")),
+        )
+        capture.request_body_too_large = capture.request_size is not None and capture.request_size > max_body_size
+        request_capture = (
+            config.log_request_body
+            and capture_level == CaptureLevel.FULL
+            and not capture.request_body_too_large
+            and is_supported_content_type(request.headers.get("Content-Type"))
+        )
         response_chunked = False
-        response_content_type: str | None = None
-        exception: BaseException | None = None
+        response_capture = False
+        response_streaming = False
+        response_decoder: BodyDecoder | None = None
+        profile = (
+            sampling_profiler.start(config.profile_slow_threshold)
+            if config.profile_slow_threshold is not None and capture_level < CaptureLevel.METADATA
+            else None
+        )
+        log_capture_token = None
+        if self.config.capture_logs and capture_level < CaptureLevel.METADATA:
+            capture.log_buffer, log_capture_token = start_log_capture()
+        capture.overhead = time.thread_time() - cpu_start_time
 
         async def receive_wrapper() -> Message:
-            nonlocal request_body, request_body_too_large
+            nonlocal request_capture
 
             message = await receive()
-            if message["type"] == "http.request":
-                if (
-                    self.config.log_request_body
-                    and not request_body_too_large
-                    and is_supported_content_type(request_content_type)
-                ):
-                    request_body += message.get("body", b"")
-                    if len(request_body) > MAX_BODY_SIZE:
-                        request_body_too_large = True
-                        request_body = b""
+            cpu_start_time = time.thread_time()
+            if message["type"] == "http.request" and request_capture:
+                chunk = message.get("body", b"")
+                if len(capture.request_body) + len(chunk) > max_body_size:
+                    capture.request_body_too_large = True
+                    request_capture = False
+                    capture.request_body = _release_body(capture.request_body)
+                elif not body_capture_budget.acquire(len(chunk)):
+                    # Capture budget exhausted, degrade to size-only
+                    request_capture = False
+                    capture.request_body = _release_body(capture.request_body)
+                else:
+                    capture.request_body += chunk
+            capture.overhead += time.thread_time() - cpu_start_time
             return message
 
         async def send_wrapper(message: Message) -> None:
-            nonlocal response_time, response_status, response_headers, response_body
-            nonlocal response_body_too_large, response_chunked, response_content_type, response_size
+            nonlocal response_chunked, response_capture, response_streaming, response_decoder
 
+            cpu_start_time = time.thread_time()
             if message["type"] == "http.response.start":
-                response_time = time.perf_counter() - start_time
-                response_status = message["status"]
-                response_headers = Headers(scope=message)
+                capture.response_time = time.perf_counter() - start_time
+                capture.response_status = message["status"]
+                capture.response_headers = Headers(scope=message)
                 response_chunked = (
-                    response_headers.get("Transfer-Encoding") == "chunked" or "Content-Length" not in response_headers
+                    capture.response_headers.get("Transfer-Encoding") == "chunked"
+                    or "Content-Length" not in capture.response_headers
                 )
-                response_content_type = response_headers.get("Content-Type")
-                response_size = (
-                    parse_content_length(response_headers.get("Content-Length")) if not response_chunked else 0
+                capture.response_size = (
+                    parse_content_length(capture.response_headers.get("Content-Length")) if not response_chunked else 0
                 )
-                response_body_too_large = response_size is not None and response_size > MAX_BODY_SIZE
-
-            elif message["type"] == "http.response.body":
-                if response_chunked and response_size is not None:
-                    response_size += len(message.get("body", b""))
-
-                should_capture = (
-                    (self.config.log_response_body or response_status == 422)
+                capture.response_body_too_large = (
+                    capture.response_size is not None and capture.response_size > max_body_size
+                )
+                response_content_type = capture.response_headers.get("Content-Type")
+                response_streaming = _is_streaming_content_type(response_content_type, config)
+                response_capture = (
+                    (config.log_response_body or capture.response_status == 422)
+                    and capture_level == CaptureLevel.FULL
+                    and not response_streaming
                     and is_supported_content_type(response_content_type)
-                    and not response_body_too_large
+                    and not capture.response_body_too_large
                 )
-                if should_capture:
-                    response_body += message.get("body", b"")
-                    if len(response_body) > MAX_BODY_SIZE:
-                        response_body_too_large = True
-                        response_body = b""
+                content_encoding = capture.response_headers.get("Content-Encoding")
+                if response_capture and content_encoding is not None and not is_identity_encoding(content_encoding):
+                    # Capture the decoded body so it can be masked, or skip capture if it can't be decoded
+                    response_decoder = create_body_decoder(content_encoding, max_body_size)
+                    response_capture = response_decoder is not None
 
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                capture.chunk_count += 1
+                if chunk and capture.time_to_first_byte is None:
+                    capture.time_to_first_byte = time.perf_counter() - start_time
+                if not message.get("more_body", False):
+                    capture.time_to_last_byte = time.perf_counter() - start_time
+                if response_chunked and capture.response_size is not None:
+                    capture.response_size += len(chunk)
+
+                if response_capture and response_decoder is not None:
+                    decoded_chunk = response_decoder.decode(chunk)
+                    if decoded_chunk is None:
+                        capture.response_body_too_large = response_decoder.too_large
+                        response_capture = False
+                        capture.response_body = _release_body(capture.response_body)
+                    chunk = decoded_chunk or b""
+
+                if response_capture:
+                    if len(capture.response_body) + len(chunk) > max_body_size:
+                        capture.response_body_too_large = True
+                        response_capture = False
+                        capture.response_body = _release_body(capture.response_body)
+                    elif not body_capture_budget.acquire(len(chunk)):
+                        # Capture budget exhausted, degrade to size-only
+                        response_capture = False
+                        capture.response_body = _release_body(capture.response_body)
+                    else:
+                        capture.response_body += chunk
+
+            capture.overhead += time.thread_time() - cpu_start_time
             await send(message)
 
+            if response_streaming and config.emit_provisional_records and message["type"] == "http.response.start":
+                self._schedule_finalize(capture, provisional=True)
+
         try:
-            await self.app(scope, receive_wrapper, send_wrapper)
+            await self.app(scope, receive_wrapper if request_capture else receive, send_wrapper)
         except BaseException as e:
-            exception = e
+            capture.exception = e
             raise
         finally:
-            if response_time is None:
-                response_time = time.perf_counter() - start_time
-
-            if request_body_too_large:
-                request_body = BODY_TOO_LARGE
-            if response_body_too_large:
-                response_body = BODY_TOO_LARGE
-
-            # Build startup data on first request
-            startup_data: StartupDataDict | None = None
+            capture.duration = time.perf_counter() - start_time
+            cpu_start_time = time.thread_time()
+            if log_capture_token is not None:
+                stop_log_capture(log_capture_token)
+            if profile is not None:
+                sampling_profiler.stop(profile)
+                if config.profile_slow_threshold is not None and capture.duration >= config.profile_slow_threshold:
+                    capture.profile = profile
+            if capture.response_time is None:
+                capture.response_time = capture.duration
+            if self.latency_tracker is not None and request_path is not None:
+                capture.outlier = self.latency_tracker.update(scope["method"], request_path, capture.response_time)
+            if self.governor is not None:
+                self.governor.exit()
             if self.is_first_request:
                 self.is_first_request = False
-                startup_data = {
-                    "paths": _get_endpoints(self.app),
-                    "versions": _get_versions(),
-                    "client": "python-serverless:starlette",
-                }
-
-            consumer = _get_consumer(request)
-            validation_errors = (
-                _extract_validation_errors(response_body) if response_status == 422 and response_body else None
-            )
+                capture.is_first_request = True
+            capture.overhead += time.thread_time() - cpu_start_time
+
+            # The record must be finalized even if the task is cancelled while awaiting here, as finalizing releases
+            # the capture budget and feeds the governor
+            try:
+                if self.consumer_resolver is not None and _get_consumer(request) is None:
+                    consumer = await self.consumer_resolver.resolve(request.headers)
+                    if consumer is not None:
+                        request.state.apitally_consumer = consumer
+                if capture.finalize_future is not None:
+                    # Make sure the provisional record is logged before the final one
+                    await asyncio.shield(asyncio.wrap_future(capture.finalize_future))
+            finally:
+                self._schedule_finalize(capture)
+
+    def _schedule_finalize(self, capture: "_RequestCapture", provisional: bool = False) -> None:
+        callback = partial(self._finalize, capture, provisional=provisional)
+        threshold = self.config.finalize_executor_threshold
+        if (
+            self.finalize_executor is not None
+            and threshold is not None
+            and len(capture.request_body) + len(capture.response_body) >= threshold
+        ):
+            future = self.finalize_executor.submit(callback)
+            if future is not None:
+                capture.finalize_future = future
+                return
+        if self.config.finalize_scheduler is not None:
+            self.config.finalize_scheduler(capture.request.scope, callback)
+        else:
+            callback()
+
+    def _finalize(self, capture: "_RequestCapture", provisional: bool = False) -> None:
+        """
+        Build, mask and log the record for a captured request.
+
+        Provisional records are emitted when a long-lived streaming response starts and are followed by the final
+        record with the same request UUID once the response has completed.
+        """
+        start_time = time.perf_counter()
+        cpu_start_time = time.thread_time()
+        config = capture.policy.config
+        include_headers = capture.capture_level < CaptureLevel.METADATA
+        request = capture.request
+        request_body = BODY_TOO_LARGE if capture.request_body_too_large else capture.request_body
+        response_body = BODY_TOO_LARGE if capture.response_body_too_large else capture.response_body
+
+        # Build startup data on first request
+        startup_data: StartupDataDict | None = None
+        if capture.is_first_request and not provisional:
+            startup_data = {
+                "paths": compiled_state_registry.get(
+                    "endpoints", None, partial(_get_endpoints, self.app), owner=self.app
+                ),
+                "versions": compiled_state_registry.get("versions", None, _get_versions),
+                "client": "python-serverless:starlette",
+            }
 
-            data: OutputDataDict = {
-                "instance_uuid": self.instance_uuid,
-                "request_uuid": str(uuid4()),
-                "startup": startup_data,
-                "consumer": {
-                    "identifier": consumer.identifier,
-                    "name": consumer.name,
-                    "group": consumer.group,
-                }
-                if consumer and (consumer.name or consumer.group)
-                else None,
-                "request": {
-                    "path": _get_path(request),
-                    "headers": convert_headers(request.headers.items()),
-                    "size": request_size,
-                    "consumer": consumer.identifier if consumer else None,
-                    "body": request_body or None,
-                },
-                "response": {
-                    "response_time": response_time,
-                    "status_code": response_status,
-                    "headers": convert_headers(response_headers.items()),
-                    "size": response_size,
-                    "body": response_body or None,
-                },
-                "validation_errors": validation_errors,
-                "exception": {
-                    "type": get_exception_type(exception),
-                    "msg": get_truncated_exception_msg(exception),
-                    "traceback": get_truncated_exception_traceback(exception),
-                }
-                if exception
-                else None,
+        consumer = _get_consumer(request)
+        validation_errors = (
+            _extract_validation_errors(response_body) if capture.response_status == 422 and response_body else None
+        )
+        exception = capture.exception
+
+        data: OutputDataDict = {
+            "instance_uuid": self.instance_uuid,
+            "request_uuid": capture.request_uuid,
+            "startup": startup_data,
+            "consumer": {
+                "identifier": consumer.identifier,
+                "name": consumer.name,
+                "group": consumer.group,
+            }
+            if consumer and (consumer.name or consumer.group)
+            else None,
+            "request": {
+                "path": capture.path,
+                "headers": convert_headers(request.headers.items()) if include_headers else None,
+                "size": capture.request_size,
+                "consumer": consumer.identifier if consumer else None,
+                "body": request_body or None,
+            },
+            "response": {
+                "response_time": capture.response_time or 0.0,
+                "status_code": capture.response_status,
+                "headers": convert_headers(capture.response_headers.items()) if include_headers else None,
+                "size": capture.response_size if not provisional else None,
+                "body": response_body or None,
+                "time_to_first_byte": capture.time_to_first_byte,
+                "time_to_last_byte": capture.time_to_last_byte,
+                "chunk_count": capture.chunk_count,
+            },
+            "validation_errors": validation_errors,
+            "exception": {
+                "type": get_exception_type(exception),
+                "msg": get_truncated_exception_msg(exception),
+                "traceback": get_truncated_exception_traceback(exception),
             }
+            if exception
+            else None,
+        }
+        if provisional:
+            data["provisional"] = True
+        elif capture.profile is not None:
+            folded_stacks = capture.profile.get_folded_stacks()
+            if folded_stacks:
+                data["profile"] = folded_stacks
+        if capture.outlier:
+            data["outlier"] = True
+        if self.governor is not None:
+            data["capture_level"] = int(capture.capture_level)
+            if capture.capture_level == CaptureLevel.SAMPLED:
+                data["sample_rate"] = self.governor.sample_rate
 
-            self.masker.apply_masking(data)
-            log_data(data)
+        try:
+            request_body_plan, response_body_plan = (
+                self._get_body_mask_plans(capture.route, capture.policy.masker)
+                if capture.route is not None
+                else (None, None)
+            )
+            capture.policy.masker.apply_masking(data, request_body_plan, response_body_plan)
+            if capture.log_buffer is not None and not provisional and not data.get("exclude"):
+                data["logs"] = capture.log_buffer.get_logs()
+            log_data(
+                data,
+                max_split_length=config.max_split_record_length if config.split_large_records else 0,
+                string_table=self.string_table,
+            )
+        finally:
+            if not provisional:
+                body_capture_budget.release(len(capture.request_body) + len(capture.response_body))
+                if self.governor is not None:
+                    finalize_cpu_time = time.thread_time() - cpu_start_time
+                    finalize_time = time.perf_counter() - start_time
+                    self.governor.record(capture.overhead + finalize_cpu_time, capture.duration + finalize_time)
+
+    def _get_compiled(self, namespace: str, factory: Callable[[], T], owner: object | None = None) -> T:
+        """Get state compiled from the config from the process-wide registry, shared with identical instances."""
+        if self.config_key is None:
+            return factory()
+        return compiled_state_registry.get(namespace, self.config_key, factory, owner=owner)
+
+    def _get_body_mask_plans(self, route: BaseRoute, masker: DataMasker) -> tuple[MaskPlan | None, MaskPlan | None]:
+        if not self.config.schema_masking:
+            return None, None
+        key = (id(route), id(masker))
+        if key not in self.body_mask_plans:
+            self.body_mask_plans[key] = self._build_body_mask_plans(route, masker)
+        return self.body_mask_plans[key]
+
+    def _build_body_mask_plans(self, route: BaseRoute, masker: DataMasker) -> tuple[MaskPlan | None, MaskPlan | None]:
+        """Build masking plans for the request and response bodies of a route from its schema, if known."""
+        return None, None
+
+
+@dataclass
+class _RequestCapture:
+    """Raw data captured for a request, from which the record is built once the response has been sent."""
+
+    request: Request
+    route: BaseRoute | None
+    path: str | None
+    policy: ResolvedPolicy
+    request_uuid: str = field(default_factory=lambda: str(uuid4()))
+    capture_level: CaptureLevel = CaptureLevel.FULL
+    request_size: int | None = None
+    request_body: bytes = b""
+    request_body_too_large: bool = False
+    response_status: int = 0
+    response_time: float | None = None
+    response_headers: Headers = field(default_factory=Headers)
+    response_size: int | None = None
+    response_body: bytes = b""
+    response_body_too_large: bool = False
+    time_to_first_byte: float | None = None
+    time_to_last_byte: float | None = None
+    chunk_count: int = 0
+    profile: RequestProfile | None = None
+    log_buffer: LogBuffer | None = None
+    outlier: bool = False
+    exception: BaseException | None = None
+    is_first_request: bool = False
+    overhead: float = 0.0
+    duration: float = 0.0
+    finalize_future: Future | None = None
+
+
+def _is_streaming_content_type(content_type: str | None, config: ApitallyConfig) -> bool:
+    return content_type is not None and any(content_type.startswith(t) for t in config.streaming_content_types)
+
+
+def _release_body(body: bytes) -> bytes:
+    body_capture_budget.release(len(body))
+    return b""
 
 
 def set_consumer(request: Request, identifier: str, name: str | None = None, group: str | None = None) -> None:
@@ -200,25 +494,31 @@ def set_consumer(request: Request, identifier: str, name: str | None = None, gro
     request.state.apitally_consumer = ApitallyConsumer(identifier, name=name, group=group)
 
 
+def get_latency_tracker(request: Request) -> LatencyTracker | None:
+    """Get the latency tracker with current per-route p50/p95/p99 response time estimates, if enabled."""
+    tracker = getattr(request.state, "apitally_latency_tracker", None)
+    return tracker if isinstance(tracker, LatencyTracker) else None
+
+
 def _get_consumer(request: Request) -> ApitallyConsumer | None:
     if hasattr(request.state, "apitally_consumer") and isinstance(request.state.apitally_consumer, ApitallyConsumer):
         return request.state.apitally_consumer
     return None
 
 
-def _get_path(request: Request, routes: list[BaseRoute] | None = None) -> str | None:
-    if routes is None:
-        routes = request.app.routes
+def _get_route(scope: Scope, routes: list[BaseRoute]) -> tuple[BaseRoute | None, str | None]:
     for route in routes:
         if hasattr(route, "routes"):
-            path = _get_path(request, routes=getattr(route, "routes"))
-            if path is not None:
-                return path
+            match, child_scope = route.matches(scope)
+            if match != Match.NONE:
+                matched_route, path = _get_route({**scope, **child_scope}, routes=getattr(route, "routes"))
+                if matched_route is not None:
+                    return matched_route, path
         elif hasattr(route, "path"):
-            match, _ = route.matches(request.scope)
+            match, _ = route.matches(scope)
             if match == Match.FULL:
-                return request.scope.get("root_path", "") + route.path
-    return None
+                return route, scope.get("root_path", "") + route.path
+    return None, None
 
 
 def _get_endpoints(app: ASGIApp) -> list[dict[str, str]]:
@@ -229,7 +529,7 @@ def _get_endpoints(app: ASGIApp) -> list[dict[str, str]]:
 
 
 def _get_routes(app: ASGIApp | Router) -> list[BaseRoute]:
-    if isinstance(app, Router):
+    if isinstance(app, (Router, Starlette)):
         return app.routes
     elif hasattr(app, "app"):
         return _get_routes(getattr(app, "app"))
@@ -0,0 +1,21 @@
+from apitally_serverless.common.budget import CaptureBudget
+
+
+def test_capture_budget():
+    budget = CaptureBudget(limit=100)
+
+    assert budget.acquire(60) is True
+    assert budget.used == 60
+    assert budget.available == 40
+
+    # Exceeding the limit is refused without changing usage
+    assert budget.acquire(50) is False
+    assert budget.used == 60
+
+    budget.release(60)
+    assert budget.used == 0
+    assert budget.acquire(100) is True
+
+    # Releasing more than used never goes negative
+    budget.release(200)
+    assert budget.used == 0
@@ -1,4 +1,9 @@
-from apitally_serverless.common.consumers import ApitallyConsumer, _seen_consumer_hashes
+import asyncio
+from typing import Mapping
+
+from pytest_mock import MockerFixture
+
+from apitally_serverless.common.consumers import ApitallyConsumer, ConsumerResolverCache, _seen_consumer_hashes
 
 
 def test_consumer_deduplication():
@@ -18,3 +23,73 @@ def test_consumer_deduplication():
     consumer = ApitallyConsumer(identifier="user2", name="Jane", group="Admin")
     assert consumer.name == "Jane"
     assert consumer.group == "Admin"
+
+
+async def test_consumer_resolver_cache():
+    _seen_consumer_hashes.clear()
+    calls: list[str | None] = []
+
+    async def resolver(headers: Mapping[str, str]) -> ApitallyConsumer | None:
+        calls.append(headers.get("x-api-key"))
+        await asyncio.sleep(0.01)
+        if headers.get("x-api-key") == "key1":
+            return ApitallyConsumer("consumer1", name="Consumer 1", group="Group")
+        return None
+
+    cache = ConsumerResolverCache(resolver, credential_headers=["x-api-key"])
+
+    # Concurrent misses for the same credentials are coalesced
+    results = await asyncio.gather(*[cache.resolve({"x-api-key": "key1"}) for _ in range(3)])
+    assert calls == ["key1"]
+    assert all(r is not None and r.identifier == "consumer1" for r in results)
+    assert sum(1 for r in results if r is not None and r.name == "Consumer 1") == 1
+
+    # Cached consumers don't repeat name and group
+    consumer = await cache.resolve({"x-api-key": "key1"})
+    assert consumer is not None
+    assert consumer.identifier == "consumer1"
+    assert consumer.name is None
+    assert calls == ["key1"]
+
+    # Misses are cached too
+    assert await cache.resolve({"x-api-key": "unknown"}) is None
+    assert await cache.resolve({"x-api-key": "unknown"}) is None
+    assert calls == ["key1", "unknown"]
+
+    # Requests without credentials are not resolved
+    assert await cache.resolve({}) is None
+    assert len(calls) == 2
+    assert cache.misses == 2
+
+
+async def test_consumer_resolver_cache_expiry_and_eviction(mocker: MockerFixture):
+    calls: list[str | None] = []
+
+    def resolver(headers: Mapping[str, str]) -> ApitallyConsumer | None:
+        calls.append(headers.get("authorization"))
+        if headers.get("authorization") == "error":
+            raise ValueError("resolver error")
+        return ApitallyConsumer(str(headers.get("authorization")))
+
+    cache = ConsumerResolverCache(resolver, max_size=2, ttl=10.0)
+    mock_time = mocker.patch("apitally_serverless.common.consumers.time.monotonic", return_value=0.0)
+
+    await cache.resolve({"authorization": "a"})
+    await cache.resolve({"authorization": "b"})
+    await cache.resolve({"authorization": "a"})
+    assert calls == ["a", "b"]
+
+    # Least recently used entry is evicted
+    await cache.resolve({"authorization": "c"})
+    await cache.resolve({"authorization": "b"})
+    assert calls == ["a", "b", "c", "b"]
+
+    # Expired entries are resolved again
+    mock_time.return_value = 11.0
+    await cache.resolve({"authorization": "b"})
+    assert calls == ["a", "b", "c", "b", "b"]
+
+    # Errors are not cached
+    assert await cache.resolve({"authorization": "error"}) is None
+    assert await cache.resolve({"authorization": "error"}) is None
+    assert calls[-2:] == ["error", "error"]
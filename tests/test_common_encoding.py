@@ -0,0 +1,42 @@
+import gzip
+import zlib
+
+from apitally_serverless.common.encoding import create_body_decoder, is_identity_encoding
+
+
+def test_is_identity_encoding():
+    assert is_identity_encoding(None) is True
+    assert is_identity_encoding("") is True
+    assert is_identity_encoding("identity") is True
+    assert is_identity_encoding("gzip") is False
+
+
+def test_body_decoder():
+    body = b'{"message":"hello"}' * 10
+    for encoding, compressed in [("gzip", gzip.compress(body)), ("deflate", zlib.compress(body))]:
+        decoder = create_body_decoder(encoding, max_size=1000)
+        assert decoder is not None
+        decoded = b"".join(decoder.decode(compressed[i : i + 16]) or b"" for i in range(0, len(compressed), 16))
+        assert decoded == body
+
+
+def test_body_decoder_too_large():
+    # Highly compressible payload that expands far beyond the limit
+    compressed = gzip.compress(b"\0" * 1_000_000)
+    decoder = create_body_decoder("gzip", max_size=1000)
+    assert decoder is not None
+    assert decoder.decode(compressed) is None
+    assert decoder.too_large is True
+    assert decoder.size == 0
+
+
+def test_body_decoder_invalid():
+    decoder = create_body_decoder("gzip", max_size=1000)
+    assert decoder is not None
+    assert decoder.decode(b"not gzip") is None
+    assert decoder.too_large is False
+
+
+def test_body_decoder_unsupported():
+    assert create_body_decoder("br", max_size=1000) is None
+    assert create_body_decoder("gzip, br", max_size=1000) is None
@@ -0,0 +1,44 @@
+from apitally_serverless.common.governor import CaptureLevel, OverheadGovernor
+
+
+def test_governor_steps_down_and_recovers():
+    governor = OverheadGovernor(overhead_budget=0.1, window=1, min_dwell=5)
+
+    # High overhead steps down one level per dwell period
+    for _ in range(5):
+        governor.record(0.5, 1.0)
+    assert governor.level == CaptureLevel.HEADERS
+    for _ in range(15):
+        governor.record(0.5, 1.0)
+    assert governor.level == CaptureLevel.SAMPLED
+    for _ in range(5):
+        governor.record(0.5, 1.0)
+    assert governor.level == CaptureLevel.SAMPLED
+
+    # Overhead between the recovery threshold and the budget keeps the current level
+    for _ in range(10):
+        governor.record(0.08, 1.0)
+    assert governor.level == CaptureLevel.SAMPLED
+
+    # Low overhead steps back up
+    for _ in range(5):
+        governor.record(0.01, 1.0)
+    assert governor.level == CaptureLevel.METADATA
+    for _ in range(10):
+        governor.record(0.01, 1.0)
+    assert governor.level == CaptureLevel.FULL
+
+
+def test_governor_in_flight():
+    governor = OverheadGovernor(max_in_flight=2, min_dwell=1)
+
+    for _ in range(3):
+        assert governor.enter() == CaptureLevel.FULL
+    governor.record(0.0, 1.0)
+    assert governor.level == CaptureLevel.HEADERS
+
+    for _ in range(3):
+        governor.exit()
+    assert governor.in_flight == 0
+    governor.record(0.0, 1.0)
+    assert governor.level == CaptureLevel.FULL
@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+from apitally_serverless.common.latency import LatencyTracker, P2Quantile
+
+
+@pytest.mark.parametrize("p", [0.5, 0.95, 0.99])
+def test_p2_quantile(p: float):
+    rng = random.Random(42)
+    values = [rng.expovariate(10) for _ in range(20_000)]
+    estimator = P2Quantile(p)
+    for value in values:
+        estimator.add(value)
+
+    exact = sorted(values)[int(p * len(values))]
+    assert estimator.count == len(values)
+    assert estimator.value == pytest.approx(exact, rel=0.05)
+
+
+def test_p2_quantile_few_values():
+    estimator = P2Quantile(0.5)
+    assert estimator.value == 0.0
+    for value in (0.3, 0.1, 0.2):
+        estimator.add(value)
+    assert estimator.value == 0.2
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(min_samples=50, max_routes=1)
+    for i in range(100):
+        is_outlier = tracker.update("get", "/items/{id}", 0.01 + (i % 10) * 0.001)
+        assert is_outlier is False or i >= 50
+
+    assert tracker.update("GET", "/items/{id}", 1.0) is True
+    assert tracker.update("GET", "/other", 1.0) is False  # max routes reached
+
+    latency = tracker.get("GET", "/items/{id}")
+    assert latency is not None
+    assert latency["count"] == 101
+    assert 0.01 < latency["p50"] < latency["p95"] <= latency["p99"] < 1.0
+    assert tracker.get("GET", "/other") is None
+    assert list(tracker.snapshot()) == ["GET /items/{id}"]
@@ -0,0 +1,49 @@
+import logging
+
+from pytest_mock import MockerFixture
+
+from apitally_serverless.common.log_capture import LogBuffer, setup_log_capture, start_log_capture, stop_log_capture
+
+
+def test_log_buffer(mocker: MockerFixture):
+    mocker.patch("apitally_serverless.common.log_capture.MAX_LOG_MSG_LENGTH", 32)
+    buffer = LogBuffer(size=3)
+    for i in range(5):
+        buffer.append(logging.makeLogRecord({"name": "test", "levelname": "INFO", "msg": "message %d", "args": (i,)}))
+    buffer.append(logging.makeLogRecord({"name": "test", "levelname": "WARNING", "msg": "a" * 64}))
+
+    # Only the most recent records are kept, oldest first
+    logs = buffer.get_logs()
+    assert [log["message"] for log in logs[:2]] == ["message 3", "message 4"]
+    assert logs[2]["level"] == "WARNING"
+    assert len(logs[2]["message"]) == 32
+    assert logs[2]["message"].endswith("... (truncated)")
+
+
+def test_log_buffer_max_length():
+    buffer = LogBuffer()
+    for i in range(100):
+        buffer.append(logging.makeLogRecord({"name": "test", "levelname": "WARNING", "msg": f"{i:03d}" + "a" * 227}))
+
+    # Only the most recent records fit into the total length budget
+    logs = buffer.get_logs(max_length=2300)
+    assert len(logs) == 10
+    assert logs[0]["message"].startswith("090")
+    assert logs[-1]["message"].startswith("099")
+
+
+def test_log_capture():
+    setup_log_capture()
+    logger = logging.getLogger("test_log_capture")
+
+    logger.warning("before capture")
+    buffer, token = start_log_capture()
+    logger.warning("during capture: %s", "value")
+    stop_log_capture(token)
+    logger.warning("after capture")
+
+    logs = buffer.get_logs()
+    assert len(logs) == 1
+    assert logs[0]["logger"] == "test_log_capture"
+    assert logs[0]["level"] == "WARNING"
+    assert logs[0]["message"] == "during capture: value"
@@ -2,7 +2,13 @@ import json
 from typing import Any, cast
 
 from apitally_serverless.common.config import ApitallyConfig
-from apitally_serverless.common.masking import MASKED, DataMasker
+from apitally_serverless.common.masking import (
+    CACHE_ENTRY_OVERHEAD,
+    MASKED,
+    DataMasker,
+    MaskedBodyCache,
+    MaskPlan,
+)
 from apitally_serverless.common.output import OutputDataDict
 
 
@@ -166,3 +172,89 @@ def test_mask_body_fields_ndjson():
     assert masked_lines[0]["username"] == "john"
     assert masked_lines[0]["password"] == MASKED
     assert masked_lines[1]["token"] == MASKED
+
+
+def test_mask_body_with_plan():
+    masker = DataMasker(create_config())
+    plan = MaskPlan(
+        fields={
+            "name": MaskPlan(),
+            "api_secret_value": MaskPlan(mask=True),
+            "password": MaskPlan(),  # declared as not masked, so regex is skipped
+            "items": MaskPlan(items=MaskPlan(fields={"key": MaskPlan(mask=True)})),
+            "extra": MaskPlan(fallback=True),
+        }
+    )
+    request_body = {
+        "name": "john",
+        "api_secret_value": "secret",
+        "password": "visible",
+        "items": [{"key": "value", "token": "undeclared"}],
+        "extra": {"token": "nested"},
+        "undeclared_pwd": "hidden",
+    }
+    data = create_output_data(request={"body": json.dumps(request_body).encode()})
+
+    masker.apply_masking(data, request_body_plan=plan)
+
+    body = data["request"]["body"]
+    assert body is not None
+    masked = json.loads(body.decode())
+    assert masked["name"] == "john"
+    assert masked["api_secret_value"] == MASKED
+    assert masked["password"] == "visible"
+    assert masked["items"][0]["key"] == MASKED
+    assert masked["items"][0]["token"] == MASKED
+    assert masked["extra"]["token"] == MASKED
+    assert masked["undeclared_pwd"] == MASKED
+
+
+def test_masked_body_cache():
+    masker = DataMasker(create_config(masked_body_cache_size=1000))
+    assert masker.body_cache is not None
+    body = json.dumps({"username": "john", "password": "secret"}).encode()
+
+    for _ in range(3):
+        data = create_output_data(request={"body": body}, response={"body": b"not json"})
+        masker.apply_masking(data)
+        masked_body = data["request"]["body"]
+        assert masked_body is not None
+        assert json.loads(masked_body)["password"] == MASKED
+        assert data["response"]["body"] == b"not json"
+
+    # Bodies that aren't changed by masking are cached without a copy of the body
+    assert masker.body_cache.misses == 2
+    assert masker.body_cache.hits == 4
+    assert masker.body_cache.size == len(masked_body) + 2 * CACHE_ENTRY_OVERHEAD
+
+    # Non-JSON content types bypass the cache
+    data = create_output_data(
+        request={"body": b"plain", "headers": [("content-type", "text/plain")]}, response={"body": b"not json"}
+    )
+    masker.apply_masking(data)
+    assert data["request"]["body"] == b"plain"
+    assert masker.body_cache.misses == 2
+
+    # Same body with a different content type is cached separately
+    data = create_output_data(
+        request={"body": body, "headers": [("content-type", "application/vnd.api+json")]},
+        response={"body": b"not json"},
+    )
+    masker.apply_masking(data)
+    assert masker.body_cache.misses == 3
+
+
+def test_masked_body_cache_eviction():
+    cache = MaskedBodyCache(max_size=2 * (CACHE_ENTRY_OVERHEAD + 10))
+    keys = [cache.get_key(str(i).encode(), "application/json", None) for i in range(3)]
+    for key in keys:
+        cache.put(key, b"0123456789")
+
+    assert cache.lookup(keys[0]) == (False, None)
+    assert cache.lookup(keys[1]) == (True, b"0123456789")
+    assert cache.lookup(keys[2]) == (True, b"0123456789")
+    assert cache.size <= cache.max_size
+
+    # Entries larger than the cache are never stored
+    cache.put(keys[0], b"0" * cache.max_size)
+    assert cache.lookup(keys[0]) == (False, None)
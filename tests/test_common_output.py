@@ -0,0 +1,152 @@
+import base64
+import os
+import sys
+from functools import partial
+from typing import Any, cast
+
+import pytest
+
+from apitally_serverless.common.output import (
+    FRAGMENT_PREFIX,
+    MAX_LOG_MESSAGE_LENGTH,
+    FragmentReassembler,
+    OutputDataDict,
+    StringTable,
+    StringTableDecoder,
+    UnresolvedReferenceError,
+    decode_log_message,
+    log_data,
+)
+from apitally_serverless.common.scheduling import FinalizeExecutor
+
+
+def create_output_data(body_size: int = 0) -> OutputDataDict:
+    # Random bytes don't compress, so the encoded message grows with the body size
+    body = base64.b64encode(os.urandom(body_size)) if body_size else None
+    data: dict[str, Any] = {
+        "instance_uuid": "00000000-0000-0000-0000-000000000000",
+        "request_uuid": "11111111-1111-1111-1111-111111111111",
+        "startup": None,
+        "consumer": None,
+        "request": {"path": "/test", "headers": None, "size": body_size, "consumer": None, "body": body},
+        "response": {"response_time": 0.1, "status_code": 200, "headers": None, "size": None, "body": None},
+        "validation_errors": None,
+        "exception": None,
+    }
+    return cast(OutputDataDict, data)
+
+
+def test_log_data(capsys: pytest.CaptureFixture[str]):
+    log_data(create_output_data(body_size=100))
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    decoded = decode_log_message(lines[0])
+    assert decoded["request"]["path"] == "/test"
+    assert "body" in decoded["request"]
+
+
+def test_log_data_drops_bodies_when_too_large(capsys: pytest.CaptureFixture[str]):
+    log_data(create_output_data(body_size=20_000))
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert "body" not in decode_log_message(lines[0])["request"]
+
+
+def test_log_data_trims_logs_before_bodies(capsys: pytest.CaptureFixture[str]):
+    data = create_output_data(body_size=4000)
+    data["logs"] = [
+        {"timestamp": float(i), "logger": "test", "level": "WARNING", "message": os.urandom(115).hex()}
+        for i in range(100)
+    ]
+    log_data(data)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert len(lines[0]) <= MAX_LOG_MESSAGE_LENGTH
+    decoded = decode_log_message(lines[0])
+    assert "body" in decoded["request"]
+    assert 0 < len(decoded["logs"]) < 100
+    assert decoded["logs"][-1]["timestamp"] == 99.0  # most recent logs are kept
+
+
+def test_log_data_fragments(capsys: pytest.CaptureFixture[str]):
+    data = create_output_data(body_size=20_000)
+    body = data["request"]["body"]
+    log_data(data, max_split_length=60_000)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) > 1
+    assert all(line.startswith(FRAGMENT_PREFIX) for line in lines)
+    assert all(len(line) <= MAX_LOG_MESSAGE_LENGTH for line in lines)
+    assert sum(len(line) for line in lines) <= 60_000
+
+    # Fragments can be fed in any order
+    reassembler = FragmentReassembler()
+    results = [reassembler.feed(line) for line in reversed(lines)]
+    assert all(r is None for r in results[:-1])
+    assert results[-1] is not None
+    assert reassembler.pending == {}
+
+    decoded = decode_log_message(results[-1])
+    assert decoded["request_uuid"] == "11111111-1111-1111-1111-111111111111"
+    assert base64.b64decode(decoded["request"]["body"]) == body
+
+
+def test_log_data_fragments_cap(capsys: pytest.CaptureFixture[str]):
+    # Fragments of a 50 KB body would exceed the total length budget
+    log_data(create_output_data(body_size=50_000), max_split_length=30_000)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert "body" not in decode_log_message(lines[0])["request"]
+
+
+def test_log_data_string_table(capsys: pytest.CaptureFixture[str]):
+    string_table = StringTable(max_size=2, reset_interval=3)
+    decoder = StringTableDecoder()
+    for _ in range(4):
+        data = create_output_data()
+        data["request"]["path"] = "/items/{item_id}"
+        data["request"]["headers"] = [("User-Agent", "python-httpx/0.27.0"), ("Accept", "*/*")]
+        data["response"]["headers"] = [("Content-Type", "application/json")]
+        log_data(data, string_table=string_table)
+
+    raw = [decode_log_message(line) for line in capsys.readouterr().out.splitlines()]
+    assert raw[0]["request"]["path"] == {"#": 0, "v": "/items/{item_id}"}
+    assert raw[0]["request"]["headers"][1] == ["Accept", "*/*"]  # shorter than min_length
+    assert raw[0]["response"]["headers"][0][1] == "application/json"  # table full
+    assert raw[1]["request"]["path"] == {"#": 0}
+    assert raw[3]["string_table_epoch"] == 1
+    assert raw[3]["request"]["path"] == {"#": 0, "v": "/items/{item_id}"}
+
+    decoded = [decoder.decode(d) for d in raw]
+    assert all(d["request"]["path"] == "/items/{item_id}" for d in decoded)
+    assert all(d["request"]["headers"][0][1] == "python-httpx/0.27.0" for d in decoded)
+    assert "string_table_epoch" not in decoded[0]
+
+    # References to entries defined in a missing record can't be resolved
+    decoder = StringTableDecoder()
+    with pytest.raises(UnresolvedReferenceError):
+        decoder.decode(raw[1])
+
+
+def test_log_data_from_multiple_threads(capsys: pytest.CaptureFixture[str]):
+    # Switch threads as often as possible, so interleaved writes are likely if lines aren't written atomically
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        executor = FinalizeExecutor(max_workers=4, max_queue_size=32)
+        for _ in range(2000):
+            callback = partial(log_data, create_output_data(body_size=100))
+            if executor.submit(callback) is None:
+                # Pool is full, finalize inline like the middleware does
+                callback()
+        executor.shutdown()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2000
+    assert all(decode_log_message(line)["request"]["size"] == 100 for line in lines)
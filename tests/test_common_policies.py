@@ -0,0 +1,35 @@
+from apitally_serverless.common.config import ApitallyConfig, ApitallyRoutePolicy
+from apitally_serverless.common.policies import RoutePolicyIndex
+
+
+def test_route_policy_index():
+    config = ApitallyConfig(
+        log_request_body=False,
+        mask_body_fields=[r"global"],
+        route_policies=[
+            ApitallyRoutePolicy(path="/items", method="post", log_request_body=True, mask_body_fields=[r"custom"]),
+            ApitallyRoutePolicy(path="/items/{id}", log_response_headers=False, max_body_size=100),
+        ],
+    )
+    index = RoutePolicyIndex(config)
+
+    # Method-specific policy
+    policy = index.lookup("POST", "/items")
+    assert policy.config.log_request_body is True
+    assert policy.config.log_response_headers is True
+    assert policy.masker._should_mask_body_field("custom") is True
+    assert policy.masker._should_mask_body_field("global") is True
+
+    # Other methods on the same path fall back to the default policy
+    assert index.lookup("GET", "/items") is index.default
+
+    # Policy without method applies to all methods
+    policy = index.lookup("DELETE", "/items/{id}")
+    assert policy.config.log_response_headers is False
+    assert policy.config.max_body_size == 100
+    assert policy.masker._should_mask_body_field("custom") is False
+
+    # Unmatched and unknown paths use the default policy
+    assert index.lookup("GET", "/other") is index.default
+    assert index.lookup("GET", None) is index.default
+    assert index.default.config.log_request_body is False
@@ -0,0 +1,27 @@
+import time
+
+from apitally_serverless.common.profiler import SamplingProfiler
+
+
+def busy_wait(duration: float) -> None:
+    end_time = time.perf_counter() + duration
+    while time.perf_counter() < end_time:
+        pass
+
+
+async def test_sampling_profiler_skips_short_requests():
+    profiler = SamplingProfiler(interval=0.001)
+
+    # Requests running for less than a fraction of their threshold are never sampled
+    profile = profiler.start(threshold=10.0)
+    assert profile is not None
+    busy_wait(0.05)
+    profiler.stop(profile)
+    assert not profile.samples
+
+    profile = profiler.start(threshold=0.02)
+    assert profile is not None
+    busy_wait(0.1)
+    profiler.stop(profile)
+    assert profile.samples
+    assert "busy_wait" in (profile.get_folded_stacks() or "")
@@ -0,0 +1,50 @@
+import gc
+
+import pytest
+
+from apitally_serverless.common.config import ApitallyConfig, ApitallyRoutePolicy
+from apitally_serverless.common.registry import CompiledStateRegistry, freeze
+
+
+class Owner:
+    pass
+
+
+def test_registry():
+    registry = CompiledStateRegistry()
+    value = registry.get("test", "key", object)
+    assert registry.get("test", "key", object) is value
+    assert registry.get("test", "other", object) is not value
+
+    registry.invalidate("other")
+    assert registry.get("test", "key", object) is value
+    registry.invalidate("test")
+    assert registry.get("test", "key", object) is not value
+
+    registry.invalidate()
+    assert len(registry) == 0
+
+
+def test_registry_owner():
+    registry = CompiledStateRegistry()
+    owner = Owner()
+    value = registry.get("test", None, object, owner=owner)
+    assert registry.get("test", None, object, owner=owner) is value
+    assert registry.get("test", None, object, owner=Owner()) is not value
+    assert len(registry) == 1  # second owner is already gone
+
+    del owner
+    gc.collect()
+    assert len(registry) == 0
+
+
+def test_freeze():
+    config1 = ApitallyConfig(mask_headers=["x-secret"], route_policies=[ApitallyRoutePolicy(path="/a")])
+    config2 = ApitallyConfig(mask_headers=["x-secret"], route_policies=[ApitallyRoutePolicy(path="/a")])
+    config3 = ApitallyConfig(mask_headers=["x-other"])
+    assert freeze(config1) == freeze(config2)
+    assert hash(freeze(config1)) == hash(freeze(config2))
+    assert freeze(config1) != freeze(config3)
+
+    with pytest.raises(TypeError):
+        freeze({"content_types": [bytearray(b"text/event-stream")]})
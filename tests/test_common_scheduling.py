@@ -0,0 +1,28 @@
+import threading
+
+from apitally_serverless.common.scheduling import FinalizeExecutor
+
+
+def test_finalize_executor():
+    executor = FinalizeExecutor(max_workers=1, max_queue_size=1)
+    release = threading.Event()
+    results: list[int] = []
+
+    def wait_and_append() -> None:
+        release.wait(1)
+        results.append(1)
+
+    future1 = executor.submit(wait_and_append)
+    future2 = executor.submit(lambda: results.append(2))
+    assert future1 is not None and future2 is not None
+
+    # Pool is full, so the caller has to run the callback itself
+    assert executor.submit(lambda: results.append(3)) is None
+
+    release.set()
+    future2.result(timeout=1)
+    assert results == [1, 2]
+    assert executor.submit(lambda: results.append(4)) is not None
+
+    executor.shutdown()
+    assert results == [1, 2, 4]
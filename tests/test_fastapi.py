@@ -1,26 +1,50 @@
+import asyncio
 import base64
+import gc
 import gzip
 import json
-from typing import Any
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterator, Mapping
 
+import httpx
 import pytest
-from fastapi import FastAPI, Query, Request
+from fastapi import FastAPI, Query, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.testclient import TestClient
-from pydantic import BaseModel
-
-from apitally_serverless.fastapi import ApitallyMiddleware, set_consumer
-
-
-def get_app() -> FastAPI:
+from pydantic import BaseModel, Field, SecretStr
+from pytest_mock import MockerFixture
+from starlette.types import Receive, Scope, Send
+from typing_extensions import Unpack
+
+from apitally_serverless.common.budget import DEFAULT_CAPTURE_BUDGET, body_capture_budget
+from apitally_serverless.common.config import ApitallyConfigKwargs
+from apitally_serverless.common.consumers import ApitallyConsumer, _seen_consumer_hashes
+from apitally_serverless.common.governor import CaptureLevel
+from apitally_serverless.common.registry import compiled_state_registry
+from apitally_serverless.common.scheduling import FinalizeExecutor, asyncio_scheduler, wait_until_scheduler
+from apitally_serverless.fastapi import (
+    ApitallyMiddleware,
+    ApitallyRoutePolicy,
+    configure_capture_budget,
+    get_latency_tracker,
+    invalidate_compiled_state,
+    set_consumer,
+)
+
+
+def get_app(**kwargs: Unpack[ApitallyConfigKwargs]) -> FastAPI:
+    config: ApitallyConfigKwargs = {
+        "enabled": True,
+        "log_request_headers": True,
+        "log_request_body": True,
+        "log_response_headers": True,
+        "log_response_body": True,
+    }
+    config.update(kwargs)
     app = FastAPI()
-    app.add_middleware(
-        ApitallyMiddleware,
-        enabled=True,
-        log_request_headers=True,
-        log_request_body=True,
-        log_response_headers=True,
-        log_response_body=True,
-    )
+    app.add_middleware(ApitallyMiddleware, **config)
 
     @app.get("/hello")
     def get_hello(request: Request, name: str = Query(min_length=2), age: int = Query(ge=18)):
@@ -47,14 +71,20 @@ def get_app() -> FastAPI:
 
 
 def get_logged_data(capsys: pytest.CaptureFixture[str]) -> dict[str, Any] | None:
+    records = get_all_logged_data(capsys)
+    return records[0] if records else None
+
+
+def get_all_logged_data(capsys: pytest.CaptureFixture[str]) -> list[dict[str, Any]]:
     captured = capsys.readouterr()
+    records = []
     for line in captured.out.split("\n"):
         if line.startswith("apitally:"):
             encoded = line.replace("apitally:", "")
             compressed = base64.b64decode(encoded)
             decompressed = gzip.decompress(compressed)
-            return json.loads(decompressed.decode("utf-8"))
-    return None
+            records.append(json.loads(decompressed.decode("utf-8")))
+    return records
 
 
 @pytest.fixture
@@ -146,3 +176,486 @@ def test_captures_validation_errors(client: TestClient, capsys: pytest.CaptureFi
     locs = [e["loc"] for e in data["validation_errors"]]
     assert ["query", "name"] in locs
     assert ["query", "age"] in locs
+
+
+def test_body_too_large(capsys: pytest.CaptureFixture[str]):
+    client = TestClient(get_app(max_body_size=16))
+    response = client.post("/hello", json={"name": "John", "age": 20})
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert base64.b64decode(data["request"]["body"]) == b"<body too large>"
+    assert base64.b64decode(data["response"]["body"]) == b"<body too large>"
+
+
+@pytest.fixture
+def small_capture_budget() -> Iterator[None]:
+    configure_capture_budget(30)
+    yield
+    configure_capture_budget(DEFAULT_CAPTURE_BUDGET)
+
+
+def test_capture_budget_exhausted(small_capture_budget: None, capsys: pytest.CaptureFixture[str]):
+    client = TestClient(get_app())
+    ApitallyMiddleware(FastAPI())  # creating other instances must not reset the limit
+    response = client.post("/hello", json={"name": "John", "age": 20})
+    assert response.status_code == 200
+    assert body_capture_budget.used == 0
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["body"] is not None
+    assert data["request"]["size"] > 0
+    assert "body" not in data["response"]
+    assert data["response"]["size"] > 0
+
+
+def test_route_policies(capsys: pytest.CaptureFixture[str]):
+    client = TestClient(
+        get_app(
+            log_request_body=False,
+            log_response_body=False,
+            route_policies=[
+                ApitallyRoutePolicy(path="/hello", method="POST", log_request_body=True, log_response_headers=False),
+            ],
+        )
+    )
+
+    response = client.post("/hello", json={"name": "John", "age": 20})
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["body"] is not None
+    assert "body" not in data["response"]
+    assert "headers" not in data["response"]
+
+    response = client.get("/hello/123")
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert "body" not in data["response"]
+    assert data["response"]["headers"] is not None
+
+
+def test_schema_masking(capsys: pytest.CaptureFixture[str]):
+    class Credentials(BaseModel):
+        username: str
+        api_key: SecretStr
+        user_password: str = Field(alias="pwd")
+
+    class Account(BaseModel):
+        username: str
+        credentials: list[Credentials]
+        metadata: dict[str, str]
+
+    app = get_app(schema_masking=True)
+
+    @app.post("/accounts", response_model=Account)
+    def create_account(account: Account):
+        return account
+
+    client = TestClient(app)
+    body = {
+        "username": "john",
+        "credentials": [{"username": "john", "api_key": "key", "pwd": "secret"}],
+        "metadata": {"token": "abc", "team": "red"},
+        "undeclared_secret": "hidden",
+    }
+    response = client.post("/accounts", json=body)
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+
+    request_body = json.loads(base64.b64decode(data["request"]["body"]))
+    assert request_body["username"] == "john"
+    assert request_body["credentials"][0]["username"] == "john"
+    assert request_body["credentials"][0]["api_key"] == "******"
+    assert request_body["credentials"][0]["pwd"] == "******"
+    assert request_body["metadata"] == {"token": "******", "team": "red"}
+    assert request_body["undeclared_secret"] == "******"
+
+    response_body = json.loads(base64.b64decode(data["response"]["body"]))
+    assert response_body["credentials"][0]["api_key"] == "******"
+    assert response_body["credentials"][0]["pwd"] == "******"
+
+
+def test_deferred_finalization(capsys: pytest.CaptureFixture[str]):
+    scheduled: list[Callable[[], None]] = []
+    client = TestClient(get_app(finalize_scheduler=lambda scope, callback: scheduled.append(callback)))
+
+    response = client.post("/hello", json={"name": "John", "age": 20})
+    assert response.status_code == 200
+    assert get_logged_data(capsys) is None
+    assert len(scheduled) == 1
+    assert body_capture_budget.used > 0
+
+    scheduled.pop()()
+    assert body_capture_budget.used == 0
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["startup"] is not None
+    assert data["request"]["path"] == "/hello"
+    assert data["request"]["body"] is not None
+    assert data["response"]["status_code"] == 200
+
+
+async def test_deferred_finalization_with_asyncio_scheduler(capsys: pytest.CaptureFixture[str]):
+    app = get_app(finalize_scheduler=asyncio_scheduler)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        response = await client.get("/hello/123")
+        assert response.status_code == 200
+        assert get_logged_data(capsys) is None
+
+        await asyncio.sleep(0)
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["path"] == "/hello/{id}"
+
+
+async def test_deferred_finalization_with_wait_until_scheduler(capsys: pytest.CaptureFixture[str]):
+    class InvocationContext:
+        def __init__(self) -> None:
+            self.pending: list[Awaitable[None]] = []
+
+        def waitUntil(self, awaitable: Awaitable[None]) -> None:
+            self.pending.append(awaitable)
+
+    contexts: list[InvocationContext] = []
+    app = get_app(finalize_scheduler=wait_until_scheduler(lambda scope: scope["ctx"].waitUntil))
+
+    async def runtime(scope: Scope, receive: Receive, send: Send) -> None:
+        # Simulates a serverless runtime passing a per-invocation context to the app
+        ctx = InvocationContext()
+        contexts.append(ctx)
+        await app({**scope, "ctx": ctx}, receive, send)
+
+    transport = httpx.ASGITransport(app=runtime)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        response = await client.get("/hello/123")
+        assert response.status_code == 200
+        assert get_logged_data(capsys) is None
+
+    assert len(contexts) == 1 and len(contexts[0].pending) == 1
+    await contexts[0].pending[0]
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["path"] == "/hello/{id}"
+
+
+def test_finalize_executor(capsys: pytest.CaptureFixture[str], mocker: MockerFixture):
+    submit_spy = mocker.spy(FinalizeExecutor, "submit")
+    client = TestClient(get_app(finalize_executor_threshold=40))
+
+    response = client.get("/hello/123")  # below threshold, finalized inline
+    assert response.status_code == 200
+    assert submit_spy.call_count == 0
+    assert get_logged_data(capsys) is not None
+
+    response = client.post("/hello", json={"name": "John", "age": 20})
+    assert response.status_code == 200
+    assert submit_spy.call_count == 1
+    submit_spy.spy_return.result(timeout=1)
+    assert body_capture_budget.used == 0
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["path"] == "/hello"
+    assert data["request"]["body"] is not None
+
+
+@pytest.mark.parametrize(
+    "capture_level",
+    [CaptureLevel.FULL, CaptureLevel.HEADERS, CaptureLevel.METADATA, CaptureLevel.SAMPLED],
+)
+def test_overhead_governor(capture_level: CaptureLevel, capsys: pytest.CaptureFixture[str], mocker: MockerFixture):
+    mocker.patch("apitally_serverless.common.governor.OverheadGovernor.enter", return_value=capture_level)
+    mocker.patch("apitally_serverless.common.governor.OverheadGovernor.should_sample", return_value=True)
+    client = TestClient(get_app(overhead_budget=0.5))
+
+    response = client.post("/hello", json={"name": "John", "age": 20})
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["capture_level"] == capture_level
+    assert data["response"]["status_code"] == 200
+    assert ("body" in data["request"]) == (capture_level == CaptureLevel.FULL)
+    assert ("headers" in data["request"]) == (capture_level < CaptureLevel.METADATA)
+    assert ("sample_rate" in data) == (capture_level == CaptureLevel.SAMPLED)
+
+
+def test_overhead_governor_sampled_out(capsys: pytest.CaptureFixture[str], mocker: MockerFixture):
+    mocker.patch("apitally_serverless.common.governor.OverheadGovernor.enter", return_value=CaptureLevel.SAMPLED)
+    mocker.patch("apitally_serverless.common.governor.OverheadGovernor.should_sample", return_value=False)
+    client = TestClient(get_app(overhead_budget=0.5))
+
+    response = client.get("/hello/123")
+    assert response.status_code == 200
+    assert get_logged_data(capsys) is None
+
+
+def test_response_timings(client: TestClient, capsys: pytest.CaptureFixture[str]):
+    response = client.get("/hello?name=John&age=20")
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["response"]["chunk_count"] >= 1
+    assert 0 < data["response"]["response_time"] <= data["response"]["time_to_first_byte"]
+    assert data["response"]["time_to_first_byte"] <= data["response"]["time_to_last_byte"]
+
+
+def test_streaming_response(capsys: pytest.CaptureFixture[str]):
+    app = get_app(emit_provisional_records=True)
+
+    @app.get("/stream")
+    def get_stream():
+        def generate():
+            for i in range(3):
+                yield f"data: {i}\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    client = TestClient(app)
+    response = client.get("/stream")
+    assert response.status_code == 200
+
+    records = get_all_logged_data(capsys)
+    assert len(records) == 2
+    provisional, final = records
+    assert provisional["provisional"] is True
+    assert provisional["request_uuid"] == final["request_uuid"]
+    assert "size" not in provisional["response"]
+    assert "time_to_last_byte" not in provisional["response"]
+    assert "startup" not in provisional
+    assert "provisional" not in final
+    assert final["startup"] is not None
+    assert final["response"]["size"] == len(response.content)
+    assert final["response"]["chunk_count"] >= 3
+    assert final["response"]["time_to_last_byte"] >= final["response"]["time_to_first_byte"]
+    assert "body" not in final["response"]
+
+
+def test_slow_request_profile(capsys: pytest.CaptureFixture[str]):
+    app = get_app(
+        profile_slow_threshold=10.0,
+        route_policies=[ApitallyRoutePolicy(path="/slow", profile_slow_threshold=0.02)],
+    )
+
+    @app.get("/slow")
+    async def get_slow():
+        end_time = time.perf_counter() + 0.1
+        while time.perf_counter() < end_time:
+            pass
+        await asyncio.sleep(0.05)
+        return {"message": "done"}
+
+    client = TestClient(app)
+    response = client.get("/slow")
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert "profile" in data
+    assert len(data["profile"]) <= 2048
+    assert "get_slow" in data["profile"]
+    stack, count = data["profile"].split("\n")[0].rsplit(" ", 1)
+    assert ";" in stack
+    assert int(count) > 0
+
+    # Requests below the threshold don't include a profile
+    response = client.get("/hello/123")
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert "profile" not in data
+
+
+def test_captures_logs(capsys: pytest.CaptureFixture[str]):
+    app = get_app(capture_logs=True)
+    logger = logging.getLogger("test_fastapi")
+
+    @app.get("/logs")
+    def get_logs():
+        logger.warning("Handling request %d", 1)
+        logger.error("Something went wrong")
+        return {"message": "done"}
+
+    client = TestClient(app)
+    response = client.get("/logs")
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert [(log["level"], log["message"]) for log in data["logs"]] == [
+        ("WARNING", "Handling request 1"),
+        ("ERROR", "Something went wrong"),
+    ]
+    assert all(log["logger"] == "test_fastapi" for log in data["logs"])
+
+
+def test_latency_tracking(capsys: pytest.CaptureFixture[str]):
+    app = get_app(latency_tracking=True, latency_min_samples=5)
+    latencies: list[Any] = []
+
+    @app.get("/latency")
+    def get_latency(request: Request, delay: float = 0.0):
+        time.sleep(delay)
+        tracker = get_latency_tracker(request)
+        assert tracker is not None
+        latencies.append(tracker.get("GET", "/latency"))
+        return {}
+
+    client = TestClient(app)
+    for _ in range(5):
+        assert client.get("/latency").status_code == 200
+    assert client.get("/latency", params={"delay": 0.1}).status_code == 200
+
+    records = get_all_logged_data(capsys)
+    assert len(records) == 6
+    assert not any(r.get("outlier") for r in records[:5])
+    assert records[5]["outlier"] is True
+    assert latencies[0] is None
+    assert latencies[5]["count"] == 5
+
+
+def test_shared_compiled_state():
+    invalidate_compiled_state()
+    middleware1 = ApitallyMiddleware(get_app(), mask_headers=["x-secret"])
+    middleware2 = ApitallyMiddleware(get_app(), mask_headers=["x-secret"])
+    middleware3 = ApitallyMiddleware(get_app(), mask_headers=["x-other"])
+    assert middleware1.policies is middleware2.policies
+    assert middleware1.masker is middleware2.masker
+    assert middleware1.masker is not middleware3.masker
+    assert middleware1.body_mask_plans is not middleware2.body_mask_plans  # different apps
+
+    invalidate_compiled_state()
+    middleware4 = ApitallyMiddleware(get_app(), mask_headers=["x-secret"])
+    assert middleware4.masker is not middleware1.masker
+
+
+def test_shared_compiled_state_with_fresh_closures():
+    invalidate_compiled_state()
+    middlewares = []
+    for _ in range(50):
+        # Rebuilt apps typically pass new closures, which must not create new entries
+        middlewares.append(
+            ApitallyMiddleware(
+                FastAPI(),
+                finalize_scheduler=wait_until_scheduler(lambda scope: None),
+                consumer_resolver=lambda headers: None,
+            )
+        )
+    middlewares.clear()
+    gc.collect()
+    assert len(compiled_state_registry) == 1  # only the shared policy index remains
+
+
+def test_consumer_resolver(capsys: pytest.CaptureFixture[str]):
+    _seen_consumer_hashes.clear()
+    calls = []
+
+    def resolve_consumer(headers: Mapping[str, str]) -> ApitallyConsumer | None:
+        calls.append(headers["x-api-key"])
+        return ApitallyConsumer(f"consumer-{headers['x-api-key']}", name="Consumer")
+
+    client = TestClient(get_app(consumer_resolver=resolve_consumer))
+
+    response = client.get("/hello/123", headers={"X-API-Key": "key1"})
+    assert response.status_code == 200
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["consumer"] == "consumer-key1"
+    assert data["consumer"]["name"] == "Consumer"
+
+    response = client.get("/hello/123", headers={"X-API-Key": "key1"})
+    assert response.status_code == 200
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["consumer"] == "consumer-key1"
+    assert "consumer" not in data
+    assert calls == ["key1"]
+
+    # Consumer set in handler takes precedence
+    response = client.get("/hello?name=John&age=20", headers={"X-API-Key": "key2"})
+    assert response.status_code == 200
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["consumer"] == "test"
+    assert calls == ["key1"]
+
+
+async def test_consumer_resolver_cancelled(capsys: pytest.CaptureFixture[str]):
+    resolver_called = asyncio.Event()
+
+    async def resolve_consumer(headers: Mapping[str, str]) -> ApitallyConsumer | None:
+        resolver_called.set()
+        await asyncio.Event().wait()
+        return None  # pragma: no cover
+
+    app = get_app(consumer_resolver=resolve_consumer)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        task = asyncio.create_task(client.post("/hello", json={"name": "John", "age": 20}, headers={"X-API-Key": "a"}))
+        await resolver_called.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    # The record is still logged and the capture budget released
+    assert body_capture_budget.used == 0
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert data["request"]["path"] == "/hello"
+
+
+@pytest.mark.parametrize("max_body_size", [10_000, 100])
+def test_compressed_response_body(max_body_size: int, capsys: pytest.CaptureFixture[str]):
+    app = FastAPI()
+    app.add_middleware(GZipMiddleware, minimum_size=0)
+    app.add_middleware(ApitallyMiddleware, log_response_body=True, max_body_size=max_body_size)
+
+    @app.get("/secret")
+    def get_secret():
+        return {"items": [{"name": f"item{i}", "password": "secret"} for i in range(10)]}
+
+    client = TestClient(app)
+    response = client.get("/secret", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    body = base64.b64decode(data["response"]["body"])
+    if max_body_size < len(response.content):
+        assert body == b"<body too large>"
+    else:
+        items = json.loads(body)["items"]
+        assert len(items) == 10
+        assert all(item["password"] == "******" for item in items)
+
+
+def test_compressed_response_body_unsupported_encoding(capsys: pytest.CaptureFixture[str]):
+    app = get_app()
+
+    @app.get("/brotli")
+    def get_brotli():
+        return Response(b"\x0b\x02\x80hello\x03", media_type="application/json", headers={"Content-Encoding": "br"})
+
+    client = TestClient(app)
+    response = client.get("/brotli")
+    assert response.status_code == 200
+
+    data = get_logged_data(capsys)
+    assert data is not None
+    assert "body" not in data["response"]
+    assert data["response"]["size"] == 9
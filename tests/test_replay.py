@@ -0,0 +1,123 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, cast
+
+import pytest
+
+from apitally_serverless.common.output import (
+    OutputDataDict,
+    StringTable,
+    _create_log_fragments,
+    _create_log_message,
+    log_data,
+)
+from apitally_serverless.replay import iter_log_messages, iter_records, main, replay
+
+
+def create_log_line(**kwargs: Any) -> str:
+    data = {
+        "instance_uuid": "00000000-0000-0000-0000-000000000000",
+        "request_uuid": "00000000-0000-0000-0000-000000000000",
+        "startup": None,
+        "consumer": None,
+        "request": {
+            "path": "/items/{item_id}",
+            "headers": [("content-type", "application/json")],
+            "size": 16,
+            "consumer": None,
+            "body": b'{"name":"item1"}',
+        },
+        "response": {
+            "response_time": 0.1,
+            "status_code": 200,
+            "headers": [("content-type", "application/json"), ("content-length", "15")],
+            "size": 15,
+            "body": b'{"status":"ok"}',
+        },
+        "validation_errors": None,
+        "exception": None,
+        **kwargs,
+    }
+    return _create_log_message(cast(OutputDataDict, data))
+
+
+def test_iter_records():
+    lines = [
+        "some unrelated line\n",
+        create_log_line() + "\n",
+        json.dumps({"Logs": [{"Message": [create_log_line()]}]}) + "\n",
+        "apitally:invalid\n",
+    ]
+    records = list(iter_records(lines))
+    assert len(records) == 2
+    assert records[0]["request"]["path"] == "/items/{item_id}"
+    assert records[1]["response"]["status_code"] == 200
+
+
+def test_iter_records_with_fragments():
+    request_uuid = "11111111-1111-1111-1111-111111111111"
+    msg = create_log_line(
+        request_uuid=request_uuid, startup={"paths": [], "versions": {}, "client": os.urandom(20_000)}
+    )
+    fragments = _create_log_fragments(msg, request_uuid, max_length=60_000)
+    assert fragments is not None and len(fragments) > 1
+
+    lines = [json.dumps({"Logs": [{"Message": [f]}]}) + "\n" for f in fragments]
+    assert list(iter_log_messages(lines)) == [msg]
+    records = list(iter_records(lines))
+    assert len(records) == 1
+    assert records[0]["request_uuid"] == request_uuid
+
+
+def test_iter_records_with_string_table(capsys: pytest.CaptureFixture[str]):
+    string_table = StringTable()
+    for _ in range(2):
+        record = cast(OutputDataDict, iter_records([create_log_line()]).__next__())
+        log_data(record, string_table=string_table)
+
+    lines = capsys.readouterr().out.splitlines(keepends=True)
+    records = list(iter_records(lines))
+    assert len(records) == 2
+    assert records[1]["request"]["path"] == "/items/{item_id}"
+    assert records[1]["response"]["headers"][0][1] == "application/json"
+
+
+def test_iter_records_with_missing_string_table_definition(capsys: pytest.CaptureFixture[str]):
+    string_table = StringTable()
+    for _ in range(3):
+        record = cast(OutputDataDict, next(iter_records([create_log_line()])))
+        log_data(record, string_table=string_table)
+    lines = capsys.readouterr().out.splitlines(keepends=True)
+
+    # Records referencing entries defined in the dropped first line are skipped
+    records = list(iter_records(lines[1:]))
+    assert records == []
+
+    report = replay(iter_records(lines[1:]), baseline=False)
+    assert report.records == 0
+
+
+def test_replay():
+    lines = [create_log_line() for _ in range(5)]
+    lines.append(create_log_line(exception={"type": "builtins.ValueError", "msg": "test", "traceback": "..."}))
+    report = replay(iter_records(lines), concurrency=2, log_request_body=True, log_response_body=True)
+
+    assert report.records == 6
+    assert report.exceptions == 1
+    assert report.emitted_lines == 6
+    assert report.emitted_bytes_per_record > 0
+    assert len(report.overheads) == 6
+    assert report.throughput > 0
+
+
+def test_main(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    log_file = tmp_path / "logs.txt"
+    log_file.write_text("\n".join(create_log_line() for _ in range(3)))
+
+    assert main([str(log_file), "--limit", "2", "--no-baseline"]) == 0
+
+    out = capsys.readouterr().out
+    assert "Records replayed:        2" in out
+    assert "Overhead" not in out
+    assert "apitally:" not in out